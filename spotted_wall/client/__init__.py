@@ -0,0 +1,349 @@
+"""
+SpottedWall client
+
+Reusable client library, keeping a pool of persistent connections
+to the server::
+
+    from spotted_wall.client import SpottedWallClient
+
+    client = SpottedWallClient('tcp://127.0.0.1:4242')
+    client.add_message('Hello, world')
+    future = client.add_message_async('Hello again', color='#ff0000')
+    print future.result()
+
+Calls to ``add_message`` and ``update_message`` (including the
+``_async`` variants) made close together, eg. from several threads,
+are sent in a single ``add_messages`` / ``update_messages`` call.
+"""
+
+import contextlib
+import Queue
+import threading
+import time
+import traceback
+
+import smartrpyc.client
+from smartrpyc.client import RemoteException
+
+DEFAULT_ADDRESS = 'tcp://127.0.0.1:4242'
+
+## Maximum number of connections kept open to the server
+POOL_SIZE = 4
+
+## Number of threads running the asynchronous calls
+ASYNC_WORKERS = 2
+
+## Maximum number of calls merged in a single batch: no more than
+## the server lets a client post at once, by default
+MAX_BATCH_SIZE = 50
+
+## How long to wait for more calls to be batched together, before
+## sending a batch. Calls queued while a batch is in flight are
+## batched anyway, so this is usually not needed.
+BATCH_DELAY = 0
+
+
+class Future(object):
+    """The result of an asynchronous call, to be available later"""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Wait for the call to complete, and return its result"""
+        if not self._done.wait(timeout):
+            raise RuntimeError("Timed out waiting for the result")
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise RuntimeError("Timed out waiting for the result")
+        return self._exception
+
+    def add_done_callback(self, function):
+        """Call ``function(future)`` once done (maybe right away)"""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(function)
+                return
+        function(self)
+
+    def set_result(self, result):
+        self._result = result
+        self._set_done()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._set_done()
+
+    def _set_done(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for function in callbacks:
+            # noinspection PyBroadException
+            try:
+                function(self)
+            except:
+                traceback.print_exc()
+
+
+class ConnectionPool(object):
+    """
+    Pool of persistent connections to the server.
+
+    SmartRPyC clients can't be shared among threads, so each one
+    is used by a single thread at a time.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, size=POOL_SIZE):
+        self.address = address
+        self.size = size
+
+        ## Idle connections, most recently used first, plus a None
+        ## for each connection that can still be opened
+        self._idle = Queue.LifoQueue()
+        for i in xrange(size):
+            self._idle.put(None)
+
+    def _get(self):
+        connection = self._idle.get()
+        if connection is None:
+            try:
+                connection = smartrpyc.client.Client(self.address)
+            except:
+                self._idle.put(None)
+                raise
+        return connection
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Borrow a connection from the pool"""
+        connection = self._get()
+        try:
+            yield connection
+        except RemoteException:
+            self._idle.put(connection)
+            raise
+        except:
+            ## Something went wrong with the socket itself (eg.
+            ## interrupted mid-request): don't reuse it, but leave
+            ## its slot to the next thread, maybe already waiting.
+            self._idle.put(None)
+            raise
+        else:
+            self._idle.put(connection)
+
+    def call(self, method, *args, **kwargs):
+        with self.connection() as connection:
+            return getattr(connection, method)(*args, **kwargs)
+
+
+def _add_items(text, color=None, duration=None, priority=None):
+    return [{'text': text, 'color': color, 'duration': duration,
+             'priority': priority}]
+
+
+def _check_added(items, results):
+    if results[0] is None:
+        raise RemoteException('BacklogFull', 'Too many messages on the wall')
+    return results[0]
+
+
+def _check_updated(items, results):
+    if not results[0]:
+        raise RemoteException('KeyError', str(items[0][0]))
+
+
+## Calls that get merged into batch calls:
+## ``{method: (batch_method, get_items, get_result)}``
+BATCHES = {
+    'add_message': ('add_messages', _add_items, _check_added),
+    'update_message': (
+        'update_messages',
+        lambda message_id, values: [(message_id, values)],
+        _check_updated),
+}
+
+
+class SpottedWallClient(object):
+    """
+    Client for the Spotted Wall RPC server.
+
+    All the server methods are available as methods of this object;
+    calls are thread-safe, and use a pool of connections.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, pool_size=POOL_SIZE,
+                 async_workers=ASYNC_WORKERS, max_batch_size=MAX_BATCH_SIZE,
+                 batch_delay=BATCH_DELAY):
+        self.pool = ConnectionPool(address, size=pool_size)
+        self.async_workers = async_workers
+        self.max_batch_size = max_batch_size
+        self.batch_delay = batch_delay
+        self._batch_queue = Queue.Queue()
+        self._async_queue = Queue.Queue()
+        self._threads = []
+        self._threads_lock = threading.Lock()
+
+    def _start_threads(self):
+        with self._threads_lock:
+            if self._threads:
+                return
+            targets = [self._run_batches]
+            targets.extend([self._run_async] * self.async_workers)
+            for target in targets:
+                thread = threading.Thread(target=target)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def close(self):
+        """Wait for the pending calls to complete, and stop the threads"""
+        with self._threads_lock:
+            threads, self._threads = self._threads, []
+        if not threads:
+            return
+        self._batch_queue.put(None)
+        for i in xrange(self.async_workers):
+            self._async_queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    def __getattr__(self, item):
+        if item.startswith('_'):
+            raise AttributeError(item)
+
+        def method_proxy(*args, **kwargs):
+            return self.pool.call(item, *args, **kwargs)
+
+        return method_proxy
+
+    ##------------------------------------------------------------------
+    ## Asynchronous calls
+    ##------------------------------------------------------------------
+
+    def call_async(self, method, *args, **kwargs):
+        """Call a server method in background, returning a Future"""
+        self._start_threads()
+        future = Future()
+        if method in BATCHES:
+            self._batch_queue.put((method, args, kwargs, future))
+        else:
+            self._async_queue.put((method, args, kwargs, future))
+        return future
+
+    def add_message_async(self, text, color=None, duration=None,
+                          priority=None):
+        return self.call_async('add_message', text, color=color,
+                               duration=duration, priority=priority)
+
+    def update_message_async(self, message_id, values):
+        return self.call_async('update_message', message_id, values)
+
+    def list_messages_async(self, offset=0, limit=None, since_id=None,
+                            since_key=None, fields=None):
+        return self.call_async('list_messages', offset=offset, limit=limit,
+                               since_id=since_id, since_key=since_key,
+                               fields=fields)
+
+    ## The synchronous variants go through the batches too
+
+    def add_message(self, text, color=None, duration=None, priority=None):
+        return self.add_message_async(text, color, duration,
+                                      priority).result()
+
+    def update_message(self, message_id, values):
+        return self.update_message_async(message_id, values).result()
+
+    def _run_async(self):
+        while True:
+            call = self._async_queue.get()
+            if call is None:
+                return
+            method, args, kwargs, future = call
+            self._call(future, method, args, kwargs)
+
+    def _call(self, future, method, args, kwargs):
+        try:
+            result = self.pool.call(method, *args, **kwargs)
+        except Exception, e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    ##------------------------------------------------------------------
+    ## Batching
+    ##------------------------------------------------------------------
+
+    def _get_calls(self):
+        """
+        Wait for some calls to be queued, then take them all.
+
+        :return: a ``(calls, stop)`` tuple; ``stop`` is True once
+            the client is being closed.
+        """
+        call = self._batch_queue.get()
+        if call is None:
+            return [], True
+        calls = [call]
+        if self.batch_delay:
+            time.sleep(self.batch_delay)
+        while len(calls) < self.max_batch_size:
+            try:
+                call = self._batch_queue.get_nowait()
+            except Queue.Empty:
+                break
+            if call is None:
+                return calls, True
+            calls.append(call)
+        return calls, False
+
+    def _run_batches(self):
+        stop = False
+        while not stop:
+            calls, stop = self._get_calls()
+            ## Merge consecutive calls of the same kind, keeping order
+            start = 0
+            while start < len(calls):
+                end = start + 1
+                while end < len(calls) and calls[end][0] == calls[start][0]:
+                    end += 1
+                self._send_batch(calls[start:end])
+                start = end
+
+    def _send_batch(self, calls):
+        if len(calls) == 1:
+            method, args, kwargs, future = calls[0]
+            self._call(future, method, args, kwargs)
+            return
+
+        batch_method = BATCHES[calls[0][0]][0]
+        try:
+            items = [BATCHES[method][1](*args, **kwargs)
+                     for method, args, kwargs, future in calls]
+            results = self.pool.call(
+                batch_method, [item for chunk in items for item in chunk])
+        except Exception:
+            ## Let each call fail (or succeed) on its own
+            for method, args, kwargs, future in calls:
+                self._call(future, method, args, kwargs)
+            return
+
+        offset = 0
+        for (method, args, kwargs, future), chunk in zip(calls, items):
+            chunk_results = results[offset:offset + len(chunk)]
+            offset += len(chunk)
+            try:
+                future.set_result(BATCHES[method][2](chunk, chunk_results))
+            except Exception, e:
+                future.set_exception(e)
@@ -2,11 +2,13 @@
 SpottedWall client
 """
 
-## Todo: This should be moved!
-
+import json
 import optparse
+import sys
+import time
 
-import smartrpyc.client
+from spotted_wall.client import SpottedWallClient, DEFAULT_ADDRESS, \
+    RemoteException
 
 parser = optparse.OptionParser()
 parser.disable_interspersed_args()
@@ -18,36 +20,125 @@ parser.add_option('--help-commands', action='store_true', dest='help_commands',
 help_commands = """\
 Commands:
 
-add
-    Create a new message
+add [<text>]
+    Create a new message. Use -f to read messages from a file
+    (or - for stdin), one per line.
 
 list
-    List messages on board
+    List messages on board. Use --limit / --after to paginate,
+    --fields to select the fields to show.
 
 update <id>
     Update the selected message (not yet)
 
-delete <id>
-    Delete the selected message
+delete <id> [<id> ...]
+    Delete the selected message(s)
+
+stats [--reset]
+    Show the server timings and caches statistics
+
+watch [<event type> ...]
+    Print the board events as they happen (the server must be started
+    with --events-address). Optionally, only the given event types.
 """
 
+## Maximum number of messages to send in a single batch call: no
+## more than the server lets a client post at once, by default
+BATCH_SIZE = 50
+
+## How long to wait before sending a batch again, when posting
+## faster than the server allows
+RATE_LIMIT_WAIT = 1.
+
+
+def iter_batches(items, size=BATCH_SIZE):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
 
 def command_add(connection, args):
     parser = optparse.OptionParser()
     parser.add_option('-c', '--color', dest='color', metavar='COLOR',
                       help="Set the message color.")
     parser.add_option('-d', '--duration', dest='duration', metavar='SECONDS',
+                      type='float',
                       help="Specify for how long the message will be shown"
                            "on the screen.")
+    parser.add_option('-p', '--priority', dest='priority',
+                      metavar='PRIORITY',
+                      help="Priority class: high, normal or low.")
+    parser.add_option('-f', '--file', dest='file', metavar='FILE',
+                      help="Read messages from a file, one per line. "
+                           "Use - to read from standard input.")
     options, args = parser.parse_args(args)
 
-    connection.add_message(args[0],
-                           color=options.color,
-                           duration=options.duration)
+    if options.file is None:
+        connection.add_message(args[0],
+                               color=options.color,
+                               duration=options.duration,
+                               priority=options.priority)
+        return
+
+    if options.file == '-':
+        infile = sys.stdin
+    else:
+        infile = open(options.file)
+
+    try:
+        messages = ({'text': line.rstrip('\n'),
+                     'color': options.color,
+                     'duration': options.duration,
+                     'priority': options.priority}
+                    for line in infile if line.strip())
+        for batch in iter_batches(messages):
+            while True:
+                try:
+                    connection.add_messages(batch)
+                except RemoteException, e:
+                    if e.original_exc != 'RateLimitExceeded':
+                        raise
+                    time.sleep(RATE_LIMIT_WAIT)
+                else:
+                    break
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
 
 
 def command_list(connection, args):
-    for message in connection.list_messages():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--limit', dest='limit', type='int',
+                      metavar='COUNT',
+                      help="Maximum number of messages to list.")
+    parser.add_option('--since', dest='since_id', type='int', metavar='ID',
+                      help="Only list messages with a greater id, ie. "
+                           "added after the given one.")
+    parser.add_option('--after', dest='after', metavar='PRIORITY:ID',
+                      help="Only list messages after the given one, in "
+                           "display order (eg. the last one listed).")
+    parser.add_option('--fields', dest='fields', metavar='FIELDS',
+                      help="Comma-separated list of fields to show.")
+    options, args = parser.parse_args(args)
+
+    fields = None
+    if options.fields is not None:
+        fields = options.fields.split(',')
+
+    since_key = None
+    if options.after is not None:
+        priority, message_id = options.after.split(':')
+        since_key = (priority, int(message_id))
+
+    for message in connection.list_messages(limit=options.limit,
+                                            since_id=options.since_id,
+                                            since_key=since_key,
+                                            fields=fields):
         print message
 
 
@@ -58,11 +149,14 @@ def command_update(connection, args):
     parser.add_option('-d', '--duration', dest='duration', metavar='SECONDS',
                       help="Specify for how long the message will be shown"
                            "on the screen.")
+    parser.add_option('-p', '--priority', dest='priority',
+                      metavar='PRIORITY',
+                      help="Priority class: high, normal or low.")
     options, args = parser.parse_args(args)
 
     updates = {}
 
-    for key in ('color', 'duration'):
+    for key in ('color', 'duration', 'priority'):
         value = getattr(options, key)
         if value is not None:
             updates[key] = value
@@ -71,14 +165,48 @@ def command_update(connection, args):
 
 
 def command_delete(connection, args):
-    connection.delete_message(int(args[0]))
+    if len(args) == 1:
+        connection.delete_message(int(args[0]))
+        return
+    for batch in iter_batches(int(x) for x in args):
+        connection.delete_messages(batch)
+
+
+def command_stats(connection, args):
+    parser = optparse.OptionParser()
+    parser.add_option('--reset', action='store_true', dest='reset',
+                      default=False, help="Reset the statistics afterwards.")
+    options, args = parser.parse_args(args)
+
+    print json.dumps(connection.stats(reset=options.reset),
+                     indent=4, sort_keys=True)
+
+
+def command_watch(connection, args):
+    import zmq
+    from smartrpyc.utils.serialization import MsgPackSerializer
+
+    parser = optparse.OptionParser()
+    parser.add_option('--events-address', dest='events_address',
+                      metavar='ADDR', default='tcp://127.0.0.1:4243',
+                      help="Address of the server events publisher.")
+    options, args = parser.parse_args(args)
+
+    socket = zmq.Context.instance().socket(zmq.SUB)
+    socket.connect(options.events_address)
+    for event_type in (args or ['']):
+        socket.setsockopt(zmq.SUBSCRIBE, event_type)
+
+    while True:
+        event_type, event = socket.recv_multipart()
+        print MsgPackSerializer.unpackb(event)
 
 
 if __name__ == '__main__':
     options, args = parser.parse_args()
-    address = options.address or 'tcp://127.0.0.1:4242'
+    address = options.address or DEFAULT_ADDRESS
 
-    c = smartrpyc.client.Client(address)
+    c = SpottedWallClient(address, pool_size=1)
 
     command = args.pop(0)
 
@@ -94,5 +222,13 @@ if __name__ == '__main__':
     elif command == 'delete':
         command_delete(c, args)
 
+    elif command == 'stats':
+        command_stats(c, args)
+
+    elif command == 'watch':
+        command_watch(c, args)
+
     else:
         raise RuntimeError("Unknown command %s" % command)
+
+    c.close()
@@ -3,16 +3,26 @@ Server application
 """
 
 import shlex
+import threading
 import traceback
 
 # noinspection PyUnresolvedReferences
 import readline
 
 from spotted_wall.server.screen import SpottedWallScreenThread
-from spotted_wall.server.rpc_server import SpottedRpcMethods, RPCServerThread
+from spotted_wall.server.screen.tiles import TilesPublisherThread, \
+    RemoteTilesOutput
+from spotted_wall.server.rpc_server import SpottedRpcMethods, \
+    RPCServerThread, PipelinedRPCServerThread, EventsPublisherThread
+from spotted_wall.server.stats import StatsDumpThread, stats
+from spotted_wall.server.admission import RateLimiter, RATE_LIMIT, \
+    RATE_BURST, RPC_MAX_PRIORITY
+from spotted_wall.server.journal import MessageJournal, JournalThread
 from spotted_wall.server.utils import Colors, lazy_property, \
     SeekableIterator, Counter
 
+WEB_UI_ADDRESS = '127.0.0.1:5000'
+
 
 class Application(object):
     def __init__(
@@ -27,18 +37,101 @@ class Application(object):
             rpc_server_address=None,
             enable_web_ui=False,
             web_ui_address=None,
-            messages_font_size=None):
+            messages_font_size=None,
+            dirty_rects=True,
+            headless=False,
+            events_addresses=None,
+            stats_interval=None,
+            stats_file=None,
+            journal_path=None,
+            prerender_workers=1,
+            canvas_size=None,
+            tiles=None,
+            tiles_addresses=None,
+            pipelined_rpc=False,
+            surfaces_budget=None,
+            rate_limit=RATE_LIMIT,
+            rate_burst=RATE_BURST,
+            max_backlog=None,
+            overflow_policy=None,
+            rpc_max_priority=RPC_MAX_PRIORITY):
 
         self.running = False
+        self.rpc_max_priority = rpc_max_priority
+
+        screen_options = dict(
+            initial_size=initial_size,
+            fullscreen=fullscreen,
+            show_fps=show_fps,
+            show_clock=show_clock,
+            dirty_rects=dirty_rects,
+            headless=headless,
+            prerender_workers=prerender_workers,
+            canvas_size=canvas_size,
+            tiles=tiles)
+        if messages_font_size is not None:
+            screen_options['messages_font_size'] = messages_font_size
+        if surfaces_budget is not None:
+            screen_options['surfaces_budget'] = surfaces_budget
+        if max_backlog is not None:
+            screen_options['max_backlog'] = max_backlog
+        if overflow_policy is not None:
+            screen_options['overflow_policy'] = overflow_policy
+
+        ## Per-client limit on the messages posted, via RPC or web UI
+        self.rate_limiter = None
+        if rate_limit:
+            self.rate_limiter = RateLimiter(rate_limit, rate_burst)
+            stats.register_gauge('rate_limiter', self.rate_limiter.get_usage)
 
         ## Initialize the threads
-        self.thread_screen = SpottedWallScreenThread(self)
-        self.thread_rpc = RPCServerThread(self, bind_addresses)
+        self.thread_screen = SpottedWallScreenThread(self, **screen_options)
+        if pipelined_rpc:
+            self.thread_rpc = PipelinedRPCServerThread(self, bind_addresses)
+        else:
+            self.thread_rpc = RPCServerThread(self, bind_addresses)
+        self.thread_events = None
+        if events_addresses:
+            self.thread_events = EventsPublisherThread(self, events_addresses)
+            self.screen.events.subscribe(self.thread_events.publish)
+        self.thread_tiles = None
+        if tiles_addresses:
+            self.thread_tiles = TilesPublisherThread(self, tiles_addresses)
+            self.screen.add_output(
+                RemoteTilesOutput(self.thread_tiles.publish))
+        self.thread_journal = None
+        if journal_path is not None:
+            journal = MessageJournal(journal_path)
+            messages, next_id = journal.load()
+            restored = self.screen.restore_messages(messages, next_id)
+            print "Restored {} messages from journal".format(len(restored))
+            self.thread_journal = JournalThread(self, journal, self.screen)
+            self.screen.events.subscribe(self.thread_journal.on_event)
+
+        self.thread_web = None
+        if enable_web_ui:
+            self.thread_web = WebUIThread(
+                self, web_ui_address or WEB_UI_ADDRESS)
+
+        self.thread_stats = None
+        if stats_interval:
+            self.thread_stats = StatsDumpThread(
+                self.screen.stats, stats_interval, stats_file)
 
     def run(self):
         ## Fire the threads!
         self.thread_screen.start()
         self.thread_rpc.start()
+        if self.thread_events is not None:
+            self.thread_events.start()
+        if self.thread_tiles is not None:
+            self.thread_tiles.start()
+        if self.thread_stats is not None:
+            self.thread_stats.start()
+        if self.thread_journal is not None:
+            self.thread_journal.start()
+        if self.thread_web is not None:
+            self.thread_web.start()
 
         ## Commands listening loop
         ## todo: we'd need something better for this..
@@ -89,19 +182,31 @@ class Application(object):
 
 
 
-# class WebUIThread(threading.Thread):
-#     """Thread to expose a Flask-powered Web UI"""
-#
-#     daemon = True
-#     parent = None
-#     address = None
-#
-#     def run(self):
-#         app = self.parent
-#         from spotted_wall.server.webapp import app as webapp
-#         self.webapp = webapp
-#         webapp.spotted_wall = app
-#         host, port = self.address.split(':')
-#         webapp.run(host=host, port=int(port))
+class WebUIThread(threading.Thread):
+    """Thread to expose a Flask-powered Web UI"""
+
+    daemon = True
+    parent = None
+    address = None
+
+    def __init__(self, parent, address):
+        ## Flask is only needed for the web UI
+        from spotted_wall.server.webapp import app as webapp, \
+            EventsBroadcaster
+
+        self.parent = parent
+        self.address = address
+        super(WebUIThread, self).__init__()
+        self.webapp = webapp
+        webapp.spotted_wall = parent.screen
+        webapp.rate_limiter = parent.rate_limiter
+        webapp.broadcaster = EventsBroadcaster()
+        parent.screen.events.subscribe(webapp.broadcaster.publish)
+
+    def run(self):
+        host, port = self.address.rsplit(':', 1)
+        ## Each event stream keeps a thread busy
+        self.webapp.run(host=host, port=int(port), threaded=True,
+                        use_reloader=False)
 
 
@@ -5,6 +5,10 @@ Launch the server
 import optparse
 
 from spotted_wall.server import Application
+from spotted_wall.server.admission import RATE_LIMIT, RATE_BURST, \
+    MAX_BACKLOG, OVERFLOW_POLICIES, OVERFLOW_POLICY, RPC_MAX_PRIORITY
+from spotted_wall.server.screen.message import PRIORITIES
+from spotted_wall.server.screen.tiles import parse_tile
 
 
 def get_parser():
@@ -39,12 +43,83 @@ def get_parser():
     o(group, '--rpc-address', action='append', dest='rpc_listen_address',
       metavar='ADDRESS', help='Address to which to bind the server. '
                               'Can be specified multiple times.')
+    o(group, '--events-address', action='append', dest='events_address',
+      metavar='ADDRESS', help='Address to which to bind the events '
+                              'publisher. Can be specified multiple times.')
+    o(group, '--web-ui-address', action='store', dest='web_ui_address',
+      metavar='HOST:PORT', help='Address of the web UI, if enabled '
+                                '(default: 127.0.0.1:5000).')
+    o(group, '--prerender-workers', action='store', type='int',
+      dest='prerender_workers', default=1, metavar='COUNT',
+      help='Number of threads rendering new messages in background; '
+           '0 to render them while drawing frames (default: 1).')
+    o(group, '--surfaces-budget', action='store', type='float',
+      dest='surfaces_budget', metavar='MB',
+      help='Memory the rendered messages may take; the ones shown '
+           'least recently are released first (default: 64).')
+    o(group, '--journal', action='store', dest='journal_path',
+      metavar='DIRECTORY',
+      help='Keep a journal of the messages in this directory, and '
+           'restore them from it on startup.')
+    o(group, '--stats-interval', action='store', dest='stats_interval',
+      type='float', metavar='SECONDS',
+      help='Periodically dump timing statistics, as JSON lines.')
+    o(group, '--stats-file', action='store', dest='stats_file',
+      metavar='FILE', help='File to which to append the statistics '
+                           '(default: standard output).')
+    parser.add_option_group(group)
+
+    group = optparse.OptionGroup(parser, 'Admission control')
+    o(group, '--rate-limit', action='store', type='float', dest='rate_limit',
+      default=RATE_LIMIT, metavar='MESSAGES',
+      help='Maximum messages per second each client (by address) may '
+           'post, 0 for no limit (default: {:g}).'.format(RATE_LIMIT))
+    o(group, '--rate-burst', action='store', type='int', dest='rate_burst',
+      default=RATE_BURST, metavar='MESSAGES',
+      help='Messages a client may post at once, within its rate limit '
+           '(default: {}).'.format(RATE_BURST))
+    o(group, '--max-backlog', action='store', type='int', dest='max_backlog',
+      metavar='MESSAGES', help='Maximum number of messages on the wall, '
+                               '0 for no limit (default: {}).'
+                               .format(MAX_BACKLOG))
+    o(group, '--overflow', action='store', type='choice', dest='overflow',
+      choices=OVERFLOW_POLICIES, metavar='POLICY',
+      help='What to do with new messages when the wall is full: '
+           '{} (default: {}).'.format(', '.join(OVERFLOW_POLICIES),
+                                        OVERFLOW_POLICY))
+    o(group, '--rpc-max-priority', action='store', type='choice',
+      dest='rpc_max_priority', choices=PRIORITIES,
+      default=RPC_MAX_PRIORITY, metavar='PRIORITY',
+      help='Highest priority class RPC clients may post with: '
+           '{} (default: {}).'.format(', '.join(PRIORITIES),
+                                        RPC_MAX_PRIORITY))
+    parser.add_option_group(group)
+
+    group = optparse.OptionGroup(parser, 'Tiled output')
+    o(group, '--canvas', action='store', dest='canvas', metavar='WxH',
+      help='Size of the virtual canvas the messages are laid out on '
+           '(default: the bounding box of the tiles, or the window).')
+    o(group, '--tile', action='append', dest='tiles', metavar='WxH+X+Y',
+      help='Draw this region of the canvas on the local window, '
+           'optionally at a given position in it (WxH+X+Y@X+Y). '
+           'Can be specified multiple times.')
+    o(group, '--tiles-address', action='append', dest='tiles_address',
+      metavar='ADDRESS', help='Address to which to bind the frames '
+                              'publisher, for remote render nodes. '
+                              'Can be specified multiple times.')
     parser.add_option_group(group)
 
     group = optparse.OptionGroup(parser, 'Flags')
     flag(group, 'fullscreen', False, help='Start in fullscreen mode')
     flag(group, 'fps', False, help='Show frame rate')
     flag(group, 'clock', False, help='Show clock')
+    flag(group, 'dirty-rects', True,
+         help='Only redraw the changed parts of the screen')
+    flag(group, 'headless', False,
+         help='Render offscreen, without opening a window')
+    flag(group, 'web-ui', False, help='Enable the web UI')
+    flag(group, 'pipelined-rpc', False,
+         help='Serve many RPC clients at once, merging their writes')
     parser.add_option_group(group)
 
     return parser
@@ -55,16 +130,44 @@ def main():
     options, args = parser.parse_args()
 
     if options.resolution is not None:
-        resolution = options.resolution.split('x')
+        resolution = tuple(int(x) for x in options.resolution.split('x'))
     else:
         resolution = (1280, 1024)
 
+    canvas_size = None
+    if options.canvas is not None:
+        canvas_size = tuple(int(x) for x in options.canvas.split('x'))
+    tiles = [parse_tile(spec) for spec in options.tiles or []]
+
+    surfaces_budget = None
+    if options.surfaces_budget is not None:
+        surfaces_budget = int(options.surfaces_budget * 1024 * 1024)
+
     app = Application(
         bind_addresses=options.rpc_listen_address,
         fullscreen=options.flag_fullscreen,
         initial_size=resolution,
         show_fps=options.flag_fps,
         show_clock=options.flag_clock,
+        dirty_rects=options.flag_dirty_rects,
+        headless=options.flag_headless,
+        events_addresses=options.events_address,
+        stats_interval=options.stats_interval,
+        stats_file=options.stats_file,
+        journal_path=options.journal_path,
+        prerender_workers=options.prerender_workers,
+        canvas_size=canvas_size,
+        tiles=tiles,
+        tiles_addresses=options.tiles_address,
+        pipelined_rpc=options.flag_pipelined_rpc,
+        surfaces_budget=surfaces_budget,
+        rate_limit=options.rate_limit,
+        rate_burst=options.rate_burst,
+        max_backlog=options.max_backlog,
+        overflow_policy=options.overflow,
+        rpc_max_priority=options.rpc_max_priority,
+        enable_web_ui=options.flag_web_ui,
+        web_ui_address=options.web_ui_address,
     )
 
     if options.cmd_list_resolutions:
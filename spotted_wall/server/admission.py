@@ -0,0 +1,272 @@
+"""
+Admission control for the incoming messages.
+
+Two lines of defence, against a client (eg. a misbehaving bot)
+flooding the wall:
+
+- each client gets a token bucket, limiting the rate of the messages
+  it can post (see :py:class:`RateLimiter`); clients are identified
+  by their address;
+- the messages on the board are limited in number: once the
+  :py:class:`Backlog` is full, an overflow policy decides what
+  happens to new messages.
+
+Plus, messages have a priority class (see
+:py:data:`spotted_wall.server.screen.message.PRIORITIES`): higher
+priority messages are shown first, no matter how many lower
+priority ones are waiting.
+"""
+
+import threading
+import time
+
+from spotted_wall.server.screen.message import PRIORITIES, \
+    DEFAULT_PRIORITY
+from spotted_wall.server.utils import LRUCache
+
+## Maximum number of messages on the board (shown or waiting)
+MAX_BACKLOG = 10000
+
+## What to do with new messages, when the backlog is full:
+## - reject: refuse them
+## - drop-oldest: drop the oldest message still waiting to be shown,
+##   from the lowest priority class (unless the new one has an even
+##   lower priority)
+## - merge: if a message with the same text is already on the board,
+##   return its id instead; otherwise, refuse them
+## Whatever the policy, a message is never refused while a lower
+## priority one is waiting to be shown: that one is dropped instead,
+## so floods of low priority messages can't lock the others out.
+OVERFLOW_POLICIES = ('reject', 'drop-oldest', 'merge')
+OVERFLOW_POLICY = 'reject'
+
+## Default rate limit: messages per second, and burst size
+RATE_LIMIT = 5.
+RATE_BURST = 50
+
+## Highest priority class RPC clients may post with: higher ones
+## are lowered to this (see :py:func:`clamp_priority`).
+RPC_MAX_PRIORITY = 'normal'
+
+## Maximum number of clients whose buckets are kept; the least
+## recently seen ones are forgotten (ie. get a full bucket again).
+MAX_CLIENTS = 10000
+
+
+class AdmissionError(Exception):
+    """A message was not let in"""
+
+
+class RateLimitExceeded(AdmissionError):
+    pass
+
+
+class BatchTooLarge(AdmissionError):
+    """More messages at once than the rate limit ever allows"""
+
+
+class BacklogFull(AdmissionError):
+    pass
+
+
+def clamp_priority(priority, max_priority):
+    """
+    Lower a priority class to ``max_priority``, if higher. None
+    stands for the default one; invalid ones are left alone, to be
+    refused later on.
+    """
+    if priority is None:
+        priority = DEFAULT_PRIORITY
+    if priority not in PRIORITIES:
+        return priority
+    return PRIORITIES[max(PRIORITIES.index(priority),
+                          PRIORITIES.index(max_priority))]
+
+
+class TokenBucket(object):
+    """
+    Allows ``rate`` events per second on average, in bursts
+    of up to ``burst`` events.
+    """
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.time() if now is None else now
+
+    def consume(self, count=1, now=None):
+        """Take ``count`` tokens, if available. Return whether they were"""
+        if now is None:
+            now = time.time()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if count > self.tokens:
+            return False
+        self.tokens -= count
+        return True
+
+
+class RateLimiter(object):
+    """Per-client token buckets. Thread-safe."""
+
+    def __init__(self, rate=RATE_LIMIT, burst=RATE_BURST,
+                 max_clients=MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.rejected = 0
+        self._buckets = LRUCache(max_clients)
+        self._lock = threading.Lock()
+
+    def consume(self, client, count=1):
+        """
+        Account for ``count`` messages posted by ``client``.
+
+        :raises RateLimitExceeded: if the client is posting too fast;
+            nothing is taken from its bucket then.
+        :raises BatchTooLarge: if ``count`` is more than the burst
+            size: waiting won't help, the batch has to be split.
+        """
+        if count > self.burst:
+            with self._lock:
+                self.rejected += count
+            raise BatchTooLarge(
+                "Too many messages at once: at most {0} per call".format(
+                    self.burst))
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = TokenBucket(
+                    self.rate, self.burst)
+            if bucket.consume(count):
+                return
+            self.rejected += count
+        raise RateLimitExceeded(
+            "Rate limit exceeded: {0:g} messages per second".format(self.rate))
+
+    def get_usage(self):
+        return {
+            'rate': self.rate,
+            'burst': self.burst,
+            'clients': len(self._buckets),
+            'rejected': self.rejected,
+        }
+
+
+class RateLimitMiddleware(object):
+    """
+    SmartRPyC server middleware, applying a :py:class:`RateLimiter`
+    to the calls adding messages.
+
+    Clients are identified by ``request.client`` (see
+    :py:class:`spotted_wall.server.rpc_server.RPCServer`).
+    """
+
+    ## {method: function returning the number of messages added}
+    costs = {
+        'add_message': lambda *args, **kwargs: 1,
+        'add_messages': lambda messages: len(messages),
+    }
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+
+    def pre(self, request, method):
+        cost = self.costs.get(request.method)
+        if cost is None:
+            return
+        try:
+            count = cost(*request.args, **request.kwargs)
+        except TypeError:
+            return  # Invalid arguments, the call will fail anyway
+        self.limiter.consume(getattr(request, 'client', None), count)
+
+
+class Backlog(object):
+    """
+    Bounds the number of messages on the board.
+
+    Only decides which messages get in: changes are to be applied
+    by the caller, holding :py:attr:`lock` throughout.
+    """
+
+    def __init__(self, max_size=MAX_BACKLOG, overflow=OVERFLOW_POLICY):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Invalid overflow policy: {0!r}".format(overflow))
+        self.max_size = max_size
+        self.overflow = overflow
+        self.lock = threading.Lock()
+        self.rejected = 0
+        self.dropped = 0
+        self.merged = 0
+
+    def admit(self, snapshot, new_messages):
+        """
+        Decide what to do with some new messages.
+
+        :param snapshot: The current :py:class:`.screen.store.MessagesSnapshot`
+        :param new_messages: The messages to be added
+        :return: a ``(decisions, dropped)`` tuple, where ``decisions``
+            has an item for each new message: None if it is to be added,
+            the id of a message it was merged into, or a
+            :py:class:`BacklogFull` exception; ``dropped`` lists the ids
+            of the messages to be removed to make room.
+        """
+        size = len(snapshot)
+        decisions = []
+        dropped = []
+        victims = None
+        victim = None
+        texts = None
+
+        for message in new_messages:
+            if size < self.max_size:
+                decisions.append(None)
+                size += 1
+                continue
+
+            if self.overflow == 'merge':
+                if texts is None:
+                    texts = dict((m.text, message_id) for message_id, m
+                                 in snapshot.iteritems())
+                if message.text in texts:
+                    decisions.append(texts[message.text])
+                    self.merged += 1
+                    continue
+
+            ## Make room, dropping the next waiting message: one with
+            ## a lower priority, or as low, if dropping the oldest.
+            if victims is None:
+                victims = snapshot.iter_waiting()
+                victim = next(victims, None)
+            min_rank = message.priority_rank
+            if self.overflow != 'drop-oldest':
+                min_rank += 1
+            if victim is not None and \
+                    snapshot[victim].priority_rank >= min_rank:
+                dropped.append(victim)
+                decisions.append(None)
+                self.dropped += 1
+                if texts is not None and \
+                        texts.get(snapshot[victim].text) == victim:
+                    del texts[snapshot[victim].text]
+                victim = next(victims, None)
+                continue
+
+            decisions.append(BacklogFull(
+                "Too many messages on the wall ({0})".format(self.max_size)))
+            self.rejected += 1
+
+        return decisions, dropped
+
+    def get_usage(self):
+        return {
+            'max_size': self.max_size,
+            'overflow': self.overflow,
+            'rejected': self.rejected,
+            'dropped': self.dropped,
+            'merged': self.merged,
+        }
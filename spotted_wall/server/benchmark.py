@@ -0,0 +1,355 @@
+"""
+Frame-time benchmarks for the screen, running headless.
+
+Replays some synthetic workloads on an offscreen screen, reporting
+frame time percentiles, the time spent in each stage of a frame and
+memory usage. Run with::
+
+    python -m spotted_wall.server.benchmark [options] [workload ...]
+"""
+
+import json
+import optparse
+import random
+import resource
+import threading
+import timeit
+from collections import defaultdict
+
+from spotted_wall.server.screen import SpottedWallScreen
+from spotted_wall.server.screen.layout import RESIZE_DELAY
+from spotted_wall.server.screen import message as message_module
+from spotted_wall.server.screen.message import Message
+from spotted_wall.server.utils import rendered_lines_cache
+
+STAGES = ['cleanup', 'layout', 'wrap', 'render', 'blit']
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+         'eiusmod tempor incididunt ut labore et dolore magna aliqua '
+         'supercalifragilisticexpialidocious').split()
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.
+    values = sorted(values)
+    index = int(round((len(values) - 1) * pct / 100.))
+    return values[index]
+
+
+class StageTimers(object):
+    """
+    Accumulates the time spent in each stage of a frame.
+
+    Stages may be nested (eg. wrapping happens during layout): the
+    time spent in a nested stage is not accounted to the outer one.
+    Only the thread drawing the frames is accounted, not the
+    pre-rendering workers.
+    """
+
+    def __init__(self):
+        self.current = defaultdict(float)
+        self._stack = []
+        self._thread = threading.current_thread()
+
+    def wrap(self, stage, function):
+        def wrapper(*a, **kw):
+            if threading.current_thread() is not self._thread:
+                return function(*a, **kw)
+            start = timeit.default_timer()
+            self._stack.append(0.)
+            try:
+                return function(*a, **kw)
+            finally:
+                elapsed = timeit.default_timer() - start
+                nested = self._stack.pop()
+                self.current[stage] += elapsed - nested
+                if self._stack:
+                    self._stack[-1] += elapsed
+        return wrapper
+
+    def pop(self):
+        """Return the stage times of the last frame, and reset them"""
+        current, self.current = self.current, defaultdict(float)
+        return current
+
+
+def random_text(rnd, words):
+    return ' '.join(rnd.choice(WORDS) for _ in xrange(words))
+
+
+class Workload(object):
+    """Base for the benchmark workloads"""
+
+    name = None
+    description = None
+
+    def __init__(self, scale=1.):
+        self.scale = scale
+        self.random = random.Random(42)
+
+    def count(self, value):
+        return max(1, int(value * self.scale))
+
+    def add_messages(self, screen, count, words, duration=30):
+        screen.store.add_many([
+            screen._create_message(random_text(self.random, words),
+                                   duration=duration)
+            for _ in xrange(count)])
+
+    def setup(self, screen):
+        pass
+
+    def before_frame(self, screen, frame, elapsed):
+        pass
+
+
+class IdleWorkload(Workload):
+    name = 'idle'
+    description = 'A few short messages, just shown'
+
+    def setup(self, screen):
+        self.add_messages(screen, self.count(10), 5)
+
+
+class ManyWorkload(Workload):
+    name = 'many'
+    description = 'Lots of short messages, mostly queued off-screen'
+
+    def setup(self, screen):
+        self.add_messages(screen, self.count(5000), 8)
+
+
+class LongWorkload(Workload):
+    name = 'long'
+    description = 'Long messages, needing lots of wrapping'
+
+    def setup(self, screen):
+        self.add_messages(screen, self.count(50), 300)
+
+
+class BurstWorkload(Workload):
+    name = 'burst'
+    description = 'Bursts of new messages, every half second'
+
+    def setup(self, screen):
+        self._next_burst = 0.
+
+    def before_frame(self, screen, frame, elapsed):
+        if elapsed >= self._next_burst:
+            self.add_messages(screen, self.count(100), 20)
+            self._next_burst += .5
+
+
+class FadesWorkload(Workload):
+    name = 'fades'
+    description = 'Many short-lived messages, constantly fading'
+
+    def before_frame(self, screen, frame, elapsed):
+        missing = self.count(15) - len(screen.messages)
+        if missing > 0:
+            self.add_messages(screen, missing, 10, duration=2.5)
+
+
+class ResizeWorkload(Workload):
+    name = 'resize'
+    description = 'Window dragged to half width and back, settling between'
+
+    ## Size changes per drag, one every third of the resize delay;
+    ## then the width is left to settle for twice the delay.
+    drag_steps = 6
+
+    def setup(self, screen):
+        self.add_messages(screen, self.count(50), 40)
+        ## Render them first: the resize is to be timed on a full
+        ## screen, not while it is still filling up
+        width = screen.layout.get_message_width(screen.width)
+        for message in screen.messages.itervalues():
+            message.prerender(width)
+        self._size = screen.size
+        self._step = 0
+        self._next_resize = RESIZE_DELAY
+
+    def before_frame(self, screen, frame, elapsed):
+        if elapsed < self._next_resize:
+            return
+        self._step += 1
+        phase = self._step % (2 * self.drag_steps)
+        shrink = min(phase, 2 * self.drag_steps - phase)
+        width, height = self._size
+        ## A few pixels off each time, as a real drag would be: no
+        ## width seen before, to be found in the caches
+        width -= width / 2 * shrink / self.drag_steps + \
+            self.random.randrange(32)
+        screen._set_video_mode((width, height))
+        self._next_resize += RESIZE_DELAY / 3.
+        if shrink in (0, self.drag_steps):
+            self._next_resize += RESIZE_DELAY * 2
+
+
+WORKLOADS = [IdleWorkload, ManyWorkload, LongWorkload, BurstWorkload,
+             FadesWorkload, ResizeWorkload]
+
+
+def _instrument(screen, timers):
+    """
+    Wrap the stages of the frame with timers.
+
+    :return: a function restoring the module-level functions
+    """
+    screen._cleanup_messages = timers.wrap(
+        'cleanup', screen._cleanup_messages)
+    screen.layout.compute = timers.wrap('layout', screen.layout.compute)
+    screen.renderer.render = timers.wrap('blit', screen.renderer.render)
+    screen.backend.update = timers.wrap('blit', screen.backend.update)
+
+    wrap_text = message_module.wrap_pygame_text
+    render_text = message_module.render_pygame_text
+    render_message = Message.__dict__['_render']
+
+    message_module.wrap_pygame_text = timers.wrap(
+        'wrap', lambda *a, **kw: list(wrap_text(*a, **kw)))
+    message_module.render_pygame_text = timers.wrap('render', render_text)
+    Message._render = timers.wrap('render', render_message)
+
+    def restore():
+        message_module.wrap_pygame_text = wrap_text
+        message_module.render_pygame_text = render_text
+        Message._render = render_message
+
+    return restore
+
+
+def get_memory_usage():
+    """Current resident set size, in KB; None if unknown (no /proc)"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (IOError, ValueError, IndexError):
+        return None
+    return pages * resource.getpagesize() / 1024
+
+
+def get_peak_memory_usage():
+    """Maximum resident set size of the whole process so far, in KB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_workload(workload, size=(1280, 1024), duration=3.,
+                 dirty_rects=True, prerender_workers=1):
+    rendered_lines_cache.clear()
+    rss_before = get_memory_usage()
+    screen = SpottedWallScreen(initial_size=size, headless=True,
+                               dirty_rects=dirty_rects,
+                               prerender_workers=prerender_workers)
+    timers = StageTimers()
+    restore = _instrument(screen, timers)
+
+    workload.setup(screen)
+    frame_times = []
+    stage_times = defaultdict(list)
+
+    started = timeit.default_timer()
+    elapsed = 0.
+    frame = 0
+    try:
+        while elapsed < duration:
+            workload.before_frame(screen, frame, elapsed)
+            timers.pop()  # Don't account setup
+            frame_start = timeit.default_timer()
+            screen.draw_frame()
+            frame_end = timeit.default_timer()
+
+            frame_times.append(frame_end - frame_start)
+            stages = timers.pop()
+            for stage in STAGES:
+                stage_times[stage].append(stages[stage])
+
+            frame += 1
+            elapsed = frame_end - started
+    finally:
+        restore()
+
+    ## Memory taken by this workload (its screen is still around);
+    ## the peak is the process-wide one, previous workloads included.
+    rss_after = get_memory_usage()
+    rss_kb = None
+    if rss_before is not None and rss_after is not None:
+        rss_kb = rss_after - rss_before
+
+    return {
+        'workload': workload.name,
+        'frames': frame,
+        'p50': percentile(frame_times, 50) * 1000,
+        'p99': percentile(frame_times, 99) * 1000,
+        'stages': dict(
+            (stage, sum(times) * 1000 / max(1, len(times)))
+            for stage, times in stage_times.iteritems()),
+        'rss_kb': rss_kb,
+        'peak_rss_kb': get_peak_memory_usage(),
+        'lines_cache_kb': rendered_lines_cache.size / 1024,
+        'surfaces_kb': screen.surfaces.size / 1024,
+    }
+
+
+def format_result(result):
+    stages = ' '.join('{}={:.3f}'.format(stage, result['stages'][stage])
+                      for stage in STAGES)
+    if result['rss_kb'] is None:
+        rss = 'n/a'
+    else:
+        rss = '{:+d}KB'.format(result['rss_kb'])
+    return ('{workload:<8} frames={frames:<6} p50={p50:.3f}ms '
+            'p99={p99:.3f}ms | avg ms: {stages_text} | '
+            'rss={rss_text} process_peak_rss={peak_rss_kb}KB '
+            'lines_cache={lines_cache_kb}KB surfaces={surfaces_kb}KB'
+            .format(stages_text=stages, rss_text=rss, **result))
+
+
+def get_parser():
+    parser = optparse.OptionParser(
+        usage='%prog [options] [workload ...]',
+        epilog='Workloads: ' + ', '.join(
+            '{} ({})'.format(w.name, w.description) for w in WORKLOADS))
+    parser.add_option('--duration', type='float', default=3.,
+                      help='Seconds to run each workload for (default: 3)')
+    parser.add_option('--size', default='1280x1024',
+                      help='Screen size (default: 1280x1024)')
+    parser.add_option('--scale', type='float', default=1.,
+                      help='Scale the number of messages (default: 1)')
+    parser.add_option('--no-dirty-rects', action='store_false',
+                      dest='dirty_rects', default=True,
+                      help='Redraw the whole screen on each frame')
+    parser.add_option('--prerender-workers', type='int', default=1,
+                      help='Background rendering threads, 0 to render '
+                           'while drawing frames (default: 1)')
+    parser.add_option('--json', action='store_true', default=False,
+                      help='Output results as JSON, one per line')
+    return parser
+
+
+def main():
+    parser = get_parser()
+    options, args = parser.parse_args()
+
+    size = tuple(int(x) for x in options.size.split('x'))
+    workloads = dict((w.name, w) for w in WORKLOADS)
+    names = args or [w.name for w in WORKLOADS]
+
+    for name in names:
+        if name not in workloads:
+            parser.error('Unknown workload: {}'.format(name))
+
+    for name in names:
+        result = run_workload(workloads[name](scale=options.scale),
+                              size=size, duration=options.duration,
+                              dirty_rects=options.dirty_rects,
+                              prerender_workers=options.prerender_workers)
+        if options.json:
+            print json.dumps(result)
+        else:
+            print format_result(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Events about changes on the board, for anybody wanting to watch it.
+"""
+
+import threading
+import time
+
+EV_ADDED = 'added'
+EV_UPDATED = 'updated'
+EV_STATE_CHANGED = 'state-changed'
+EV_EXPIRED = 'expired'
+EV_DELETED = 'deleted'
+
+
+class EventsDispatcher(object):
+    """
+    Dispatches events to the subscribed listeners.
+
+    Events are dicts with (at least) a ``type``, the ``id`` of the
+    message they refer to and a ``time`` timestamp. Listeners are
+    called synchronously, from whatever thread emitted the event:
+    they should return quickly (eg. just queue the event).
+    """
+
+    def __init__(self):
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, listener):
+        with self._lock:
+            self._listeners = self._listeners + [listener]
+
+    def unsubscribe(self, listener):
+        with self._lock:
+            self._listeners = [l for l in self._listeners if l != listener]
+
+    def __nonzero__(self):
+        """True if anybody is listening"""
+        return bool(self._listeners)
+
+    def emit(self, event_type, message_id, **data):
+        if not self._listeners:
+            return
+        event = dict(data, type=event_type, id=message_id, time=time.time())
+        for listener in self._listeners:
+            listener(event)
@@ -0,0 +1,174 @@
+"""
+Persistent journal of the messages, to survive restarts and crashes.
+
+The journal is kept in a directory, containing:
+
+``snapshot.json``
+    A compacted dump of all the messages, written periodically.
+
+``journal.log``
+    The operations happened since the last snapshot, as JSON lines:
+    ``{"op": "put", "id": ..., "message": {...}}`` when a message is
+    added or updated, ``{"op": "del", "id": ...}`` when it's gone.
+
+Operations are taken from the board events, and written by a
+dedicated thread; all the events queued at once are written with
+a single fsync() ("group commit").
+"""
+
+import json
+import os
+import Queue
+import threading
+import time
+
+from spotted_wall.server.events import EV_ADDED, EV_UPDATED, EV_EXPIRED, \
+    EV_DELETED
+
+SNAPSHOT_FILE = 'snapshot.json'
+JOURNAL_FILE = 'journal.log'
+
+## Compact the journal into a new snapshot this often..
+SNAPSHOT_INTERVAL = 60
+## ..or as soon as it contains this many operations.
+SNAPSHOT_MAX_OPERATIONS = 10000
+
+
+class MessageJournal(object):
+    """Reads and writes the journal files"""
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._journal_file = None
+        self.operations = 0  # Written since the last snapshot
+
+    @property
+    def snapshot_path(self):
+        return os.path.join(self.path, SNAPSHOT_FILE)
+
+    @property
+    def journal_path(self):
+        return os.path.join(self.path, JOURNAL_FILE)
+
+    def load(self):
+        """
+        Replay the snapshot and journal.
+
+        :return: a ``(messages, next_id)`` tuple, where messages is
+            a list of ``(message_id, message_dict)`` tuples, sorted
+            by id, as exported by ``Message.to_dict()``.
+        """
+
+        messages = {}
+        next_id = 1
+
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            next_id = snapshot['next_id']
+            for message_id, message in snapshot['messages']:
+                messages[message_id] = message
+                next_id = max(next_id, message_id + 1)
+
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path) as f:
+                for line in f:
+                    try:
+                        operation = json.loads(line)
+                    except ValueError:
+                        break  # Truncated by a crash while writing
+                    message_id = operation['id']
+                    if operation['op'] == 'put':
+                        messages[message_id] = operation['message']
+                    else:
+                        messages.pop(message_id, None)
+                    next_id = max(next_id, message_id + 1)
+
+        return sorted(messages.iteritems()), next_id
+
+    def write(self, operations):
+        """Append some operations to the journal, and sync it to disk"""
+
+        if self._journal_file is None:
+            self._journal_file = open(self.journal_path, 'a')
+        self._journal_file.write(''.join(
+            json.dumps(operation) + '\n' for operation in operations))
+        self._journal_file.flush()
+        os.fsync(self._journal_file.fileno())
+        self.operations += len(operations)
+
+    def write_snapshot(self, messages, next_id):
+        """
+        Replace the snapshot, and empty the journal.
+
+        :param messages: a list of ``(message_id, message_dict)`` tuples
+        """
+
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'next_id': next_id, 'time': time.time(),
+                       'messages': messages}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, self.snapshot_path)
+
+        if self._journal_file is not None:
+            self._journal_file.close()
+        self._journal_file = open(self.journal_path, 'w')
+        self.operations = 0
+
+
+class JournalThread(threading.Thread):
+    """
+    Writes the board events to the journal, compacting it
+    periodically.
+    """
+
+    daemon = True
+    parent = None
+
+    def __init__(self, parent, journal, screen):
+        self.parent = parent
+        self.journal = journal
+        self.screen = screen
+        super(JournalThread, self).__init__()
+        self._queue = Queue.Queue()
+        self._last_snapshot = time.time()
+
+    def on_event(self, event):
+        """Events listener: queue the matching journal operation"""
+        if event['type'] in (EV_ADDED, EV_UPDATED):
+            self._queue.put({'op': 'put', 'id': event['id'],
+                             'message': event['message']})
+        elif event['type'] in (EV_EXPIRED, EV_DELETED):
+            self._queue.put({'op': 'del', 'id': event['id']})
+
+    def compact(self):
+        """Write a new snapshot from the current state of the board"""
+        messages, next_id = self.screen.dump_messages()
+        self.journal.write_snapshot(messages, next_id)
+        self._last_snapshot = time.time()
+
+    def run(self):
+        self.compact()
+        while True:
+            try:
+                operations = [self._queue.get(timeout=SNAPSHOT_INTERVAL)]
+            except Queue.Empty:
+                operations = []
+
+            ## Group commit: write everything queued in the meanwhile
+            while True:
+                try:
+                    operations.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+
+            if operations:
+                self.journal.write(operations)
+
+            if (self.journal.operations >= SNAPSHOT_MAX_OPERATIONS) or \
+                    (time.time() - self._last_snapshot >= SNAPSHOT_INTERVAL):
+                self.compact()
@@ -0,0 +1,107 @@
+"""
+Render node, drawing one tile of a tiled wall.
+
+The server publishes a description of each frame (see
+:py:mod:`spotted_wall.server.screen.tiles`); the node renders the
+messages falling in its tile, with the same fonts, and draws them
+in its own window::
+
+    python -m spotted_wall.server.node \\
+        --connect tcp://wall-server:4244 --tile 1920x1080+1920+0
+"""
+
+import optparse
+
+import pygame
+import zmq
+from smartrpyc.utils.serialization import MsgPackSerializer
+
+from spotted_wall.server.screen.backends import DisplayBackend, \
+    HeadlessBackend
+from spotted_wall.server.screen.tiles import RemoteTileRenderer, parse_tile
+
+DEFAULT_ADDRESS = 'tcp://127.0.0.1:4244'
+
+## Maximum time to wait for a frame, before processing pygame events
+POLL_TIMEOUT = 100  # ms
+
+
+class RenderNode(object):
+    """Receives the frames, and draws its tile of them"""
+
+    packer = MsgPackSerializer
+
+    def __init__(self, address, tile, fullscreen=False, headless=False,
+                 dirty_rects=True):
+        self.address = address
+        self.tile = tile
+        self.fullscreen = fullscreen
+        self.renderer = RemoteTileRenderer(tile, dirty_rects=dirty_rects)
+        if headless:
+            self.backend = HeadlessBackend()
+        else:
+            self.backend = DisplayBackend()
+        self.screen = None
+
+    def _set_video_mode(self):
+        self.screen = self.backend.set_mode(
+            self.tile.rect.size, self.fullscreen)
+        self.renderer.invalidate()
+
+    def _check_events(self):
+        for event in pygame.event.get():
+            if event.type in (pygame.VIDEORESIZE, pygame.VIDEOEXPOSE):
+                self.renderer.invalidate()
+            elif event.type == pygame.KEYDOWN and \
+                    event.key in (pygame.K_f, pygame.K_F11):
+                self.fullscreen = not self.fullscreen
+                self._set_video_mode()
+
+    def run(self):
+        self.backend.init()
+        self.backend.set_caption("Spotted Wall (tile {0}x{1}+{2}+{3})".format(
+            self.tile.rect.w, self.tile.rect.h,
+            self.tile.rect.x, self.tile.rect.y))
+        self._set_video_mode()
+
+        socket = zmq.Context.instance().socket(zmq.SUB)
+        socket.setsockopt(zmq.CONFLATE, 1)  # We only need the last frame
+        socket.setsockopt(zmq.SUBSCRIBE, '')
+        socket.connect(self.address)
+
+        while True:
+            self._check_events()
+            if not socket.poll(POLL_TIMEOUT):
+                continue
+            frame = self.packer.unpackb(socket.recv())
+            rects = self.renderer.render(self.screen, frame)
+            if rects:
+                self.backend.update(rects)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--connect', action='store', dest='address',
+                      default=DEFAULT_ADDRESS, metavar='ADDRESS',
+                      help='Address of the server tiles publisher '
+                           '(default: {})'.format(DEFAULT_ADDRESS))
+    parser.add_option('--tile', action='store', dest='tile',
+                      metavar='WxH+X+Y',
+                      help='Region of the wall canvas to be drawn.')
+    parser.add_option('--fullscreen', action='store_true',
+                      dest='fullscreen', default=False)
+    parser.add_option('--headless', action='store_true',
+                      dest='headless', default=False)
+    options, args = parser.parse_args()
+
+    if options.tile is None:
+        parser.error('--tile is required')
+
+    node = RenderNode(options.address, parse_tile(options.tile),
+                      fullscreen=options.fullscreen,
+                      headless=options.headless)
+    node.run()
+
+
+if __name__ == '__main__':
+    main()
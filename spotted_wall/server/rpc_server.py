@@ -1,8 +1,26 @@
 """
 Stuff for the RPC server methods
 """
+import Queue
 import threading
+import traceback
+
+import zmq
 from smartrpyc.server import Server
+from smartrpyc.server.exceptions import DirectResponse, SetMethod
+from smartrpyc.utils import lazy_property
+from smartrpyc.utils.serialization import MsgPackSerializer
+
+from spotted_wall.server.admission import BacklogFull, \
+    RateLimitMiddleware, clamp_priority
+from spotted_wall.server.stats import StatsMiddleware
+
+## Maximum number of events waiting to be published; if subscribers
+## can't keep up, newer events are dropped (as PUB sockets do anyway).
+EVENTS_QUEUE_SIZE = 10000
+
+## Maximum number of pipelined requests processed at once
+PIPELINE_MAX_REQUESTS = 1000
 
 
 class MethodsObject(object):
@@ -33,23 +51,60 @@ class SpottedRpcMethods(MethodsObject):
     def screen(self):
         return self.app.screen
 
-    def add_message(self, request, *args, **kwargs):
-        return self.screen.add_message(*args, **kwargs)
+    def _clamp_priority(self, priority):
+        ## Clients can't jump ahead of the messages typed by people
+        return clamp_priority(priority, self.app.rpc_max_priority)
+
+    def add_message(self, request, text, color=None, duration=None,
+                    priority=None):
+        return self.screen.add_message(
+            text, color=color, duration=duration,
+            priority=self._clamp_priority(priority))
 
-    def list_messages(self, request):
-        return list(self.screen.list_messages())
+    def add_messages(self, request, messages):
+        return self.screen.add_messages([
+            dict(msg, priority=self._clamp_priority(msg.get('priority')))
+            for msg in messages])
+
+    def list_messages(self, request, offset=0, limit=None, since_id=None,
+                      since_key=None, fields=None):
+        return list(self.screen.list_messages(
+            offset=offset, limit=limit, since_id=since_id,
+            since_key=since_key, fields=fields))
 
     def delete_message(self, request, message_id):
         return self.screen.delete_message(message_id)
 
+    def delete_messages(self, request, message_ids):
+        return self.screen.delete_messages(message_ids)
+
     def hide_message(self, request, message_id):
         return self.screen.hide_message(message_id)
 
+    def _clamp_values(self, values):
+        if 'priority' not in values:
+            return values
+        return dict(values,
+                    priority=self._clamp_priority(values['priority']))
+
     def update_message(self, request, message_id, values):
-        return self.screen.update_message(message_id, values)
+        return self.screen.update_message(
+            message_id, self._clamp_values(values))
+
+    def update_messages(self, request, updates):
+        return self.screen.update_messages([
+            (message_id, self._clamp_values(values))
+            for message_id, values in updates])
+
+    def get_message(self, request, message_id, fields=None):
+        return self.screen.get_message(message_id, fields=fields)
 
-    def get_message(self, request, message_id):
-        return self.screen.get_message(message_id)
+    def stats(self, request, reset=False):
+        """Return timings and caches statistics, optionally resetting them"""
+        data = self.screen.stats.to_dict()
+        if reset:
+            self.screen.stats.reset()
+        return data
 
     def server_info(self, request):
         return {
@@ -57,20 +112,336 @@ class SpottedRpcMethods(MethodsObject):
         }
 
 
+def _check_added(items, results):
+    if results[0] is None:
+        raise BacklogFull("Too many messages on the wall")
+    return results[0]
+
+
+def _all_results(items, results):
+    return results
+
+
+def _check_updated(items, results):
+    if not results[0]:
+        raise KeyError(items[0][0])
+
+
+def _check_deleted(items, results):
+    if not results[0]:
+        raise KeyError(items[0])
+
+
+## Write methods whose consecutive calls can be merged into a single
+## call of a batch method, by the :py:class:`PipelinedServer`:
+## ``{method: (batch_method, get_items, get_response)}``, where
+## ``get_items(*args, **kwargs)`` returns the batch items for a call,
+## and ``get_response(items, results)`` turns the matching results
+## of the batch into the call response (or raises).
+WRITE_BATCHES = {
+    'add_message': (
+        'add_messages',
+        lambda text, color=None, duration=None, priority=None: [
+            dict(text=text, color=color, duration=duration,
+                 priority=priority)],
+        _check_added),
+    'add_messages': (
+        'add_messages', lambda messages: list(messages), _all_results),
+    'update_message': (
+        'update_messages',
+        lambda message_id, values: [(message_id, values)],
+        _check_updated),
+    'update_messages': (
+        'update_messages',
+        lambda updates: [tuple(update) for update in updates],
+        _all_results),
+    'delete_message': (
+        'delete_messages', lambda message_id: [message_id], _check_deleted),
+    'hide_message': (
+        'delete_messages', lambda message_id: [message_id], _check_deleted),
+    'delete_messages': (
+        'delete_messages', lambda message_ids: list(message_ids),
+        _all_results),
+}
+
+
+def get_peer_address(frame):
+    """Address of the peer a message frame came from, if known"""
+    try:
+        return frame.get('Peer-Address')
+    except (zmq.ZMQError, AttributeError, KeyError):
+        return None  # Not supported by this libzmq
+
+
+class RPCServer(Server):
+    """
+    SmartRPyC server, telling who sent each request: its address
+    is set as ``request.client`` (eg. for rate limiting).
+    """
+
+    def run_once(self):
+        frame = self.socket.recv(copy=False)
+        request = self.request_class(self.packer.unpackb(frame.bytes))
+        request.server = self
+        request.client = get_peer_address(frame)
+        response = self._process_request(request)
+        self.socket.send(self.packer.packb(response))
+
+
+class PipelinedServer(RPCServer):
+    """
+    SmartRPyC-compatible server, for many clients at once.
+
+    Uses a ROUTER socket, so any number of clients can have requests
+    in flight: plain SmartRPyC (REQ) clients, as well as DEALER clients
+    sending several requests without waiting for the responses.
+
+    All the requests received are processed together, in order;
+    consecutive write requests of the same kind (eg. several
+    ``add_message`` from different clients) are merged into a single
+    batch call, and thus a single store update. Reads are served from
+    the store snapshot, as usual.
+    """
+
+    max_requests = PIPELINE_MAX_REQUESTS
+
+    def __init__(self, methods=None, batches=None):
+        super(PipelinedServer, self).__init__(methods=methods)
+        if batches is None:
+            batches = WRITE_BATCHES
+        self.batches = batches
+
+    @lazy_property
+    def socket(self):
+        return zmq.Context.instance().socket(zmq.ROUTER)
+
+    def run(self):
+        while True:
+            self.socket.poll()
+            self.run_once()
+
+    def run_once(self):
+        """Process all the requests received so far"""
+
+        received = []
+        while len(received) < self.max_requests:
+            try:
+                frames = self.socket.recv_multipart(zmq.NOBLOCK, copy=False)
+            except zmq.Again:
+                break
+            ## Whatever precedes the payload is the envelope,
+            ## to be sent back as-is along with the response.
+            envelope = [frame.bytes for frame in frames[:-1]]
+            payload = frames[-1]
+            try:
+                request = self.request_class(
+                    self.packer.unpackb(payload.bytes))
+                request.method  # Make sure it's a valid request
+            except Exception, e:
+                self._send(envelope, self._exception_message(e))
+                continue
+            request.server = self
+            request.client = get_peer_address(payload)
+            received.append((envelope, request))
+
+        for envelope, response in self._process_requests(received):
+            self._send(envelope, response)
+
+    def _send(self, envelope, response):
+        self.socket.send_multipart(envelope + [self.packer.packb(response)])
+
+    def _get_batch(self, request):
+        batch = self.batches.get(request.method)
+        if batch is not None:
+            return batch[0]
+
+    def _process_requests(self, received):
+        """
+        Process requests in order, merging consecutive writes.
+
+        :return: a list of ``(envelope, response)`` tuples
+        """
+        responses = []
+        start = 0
+        while start < len(received):
+            batch = self._get_batch(received[start][1])
+            end = start + 1
+            if batch is not None:
+                while end < len(received) and \
+                        self._get_batch(received[end][1]) == batch:
+                    end += 1
+            if end - start > 1:
+                responses.extend(
+                    self._process_batch(batch, received[start:end]))
+            else:
+                envelope, request = received[start]
+                responses.append((envelope, self._process_request(request)))
+            start = end
+        return responses
+
+    def _process_individually(self, received):
+        return [(envelope, self._process_request(request))
+                for envelope, request in received]
+
+    def _call_method(self, request, method):
+        """
+        Call a method and run the POST middleware: the rest of
+        ``_process_request``, once the PRE middleware was run.
+        """
+        try:
+            response = method(request, *request.args, **request.kwargs)
+        except Exception, e:
+            response, exception = None, e
+        else:
+            exception = None
+        return self._finish_call(request, method, response, exception)
+
+    def _finish_call(self, request, method, response, exception):
+        """Run the POST middleware, and build the response message"""
+        try:
+            response = self._exec_post_middleware(
+                request, method, response, exception)
+        except DirectResponse, e:
+            return self._response_message(e.response)
+        except Exception, e:
+            return self._exception_message(e)
+        if exception is not None:
+            return self._exception_message(exception)
+        return self._response_message(response)
+
+    def _process_batch(self, batch, received):
+        """
+        Process several write requests with a single batch call.
+
+        Requests failing in the PRE middleware (eg. rate limited)
+        just get their error, as they would on their own. If anything
+        else goes wrong (invalid arguments, middleware interfering,
+        ..) the other requests are processed one by one instead;
+        batch methods either apply all the changes or none.
+        """
+
+        calls = []
+        try:
+            for envelope, request in received:
+                method = self.methods.lookup(request.method)
+                get_items, get_response = self.batches[request.method][1:]
+                items = get_items(*request.args, **request.kwargs)
+                calls.append([envelope, request, method, items, get_response])
+        except Exception:
+            traceback.print_exc()
+            return self._process_individually(received)
+
+        ## From here on, the PRE middleware ran (eg. rate limits were
+        ## charged): requests are not to go through it again.
+        done = {}  # {call index: response message}
+        batchable = True
+        for i, call in enumerate(calls):
+            try:
+                self._exec_pre_middleware(call[1], call[2])
+            except DirectResponse, e:
+                done[i] = self._response_message(e.response)
+            except SetMethod, e:
+                call[2] = e.method
+                batchable = False
+            except Exception, e:
+                done[i] = self._exception_message(e)
+
+        results = []
+        try:
+            if not batchable:
+                raise ValueError("Methods changed by the middleware")
+            items = [item for i, call in enumerate(calls)
+                     if i not in done for item in call[3]]
+            if items:
+                results = self.methods.lookup(batch)(None, items)
+        except Exception:
+            traceback.print_exc()
+            return [(envelope, done[i] if i in done
+                     else self._call_method(request, method))
+                    for i, (envelope, request, method, items, get_response)
+                    in enumerate(calls)]
+
+        responses = []
+        offset = 0
+        for i, call in enumerate(calls):
+            envelope, request, method, items, get_response = call
+            if i in done:
+                responses.append((envelope, done[i]))
+                continue
+            call_results = results[offset:offset + len(items)]
+            offset += len(items)
+            try:
+                response = get_response(items, call_results)
+            except Exception, e:
+                response, exception = None, e
+            else:
+                exception = None
+            responses.append((envelope, self._finish_call(
+                request, method, response, exception)))
+        return responses
+
+
 class RPCServerThread(threading.Thread):
 
     daemon = True
     parent = None
     addresses = None
-    
+    server_class = RPCServer
+
     def __init__(self, parent, addresses):
         self.parent = parent
         self.addresses = addresses
         super(RPCServerThread, self).__init__()
-        self.rpc_server = Server(
+        self.rpc_server = self.server_class(
             methods=SpottedRpcMethods(self.parent))
+        self.rpc_server.middleware.append(
+            StatsMiddleware(self.parent.screen.stats))
+        if self.parent.rate_limiter is not None:
+            self.rpc_server.middleware.append(
+                RateLimitMiddleware(self.parent.rate_limiter))
 
     def run(self):
         for address in self.addresses:
             self.rpc_server.bind(address)
         self.rpc_server.run()
+
+
+class PipelinedRPCServerThread(RPCServerThread):
+    """RPC server thread, using a :py:class:`PipelinedServer`"""
+
+    server_class = PipelinedServer
+
+
+class EventsPublisherThread(threading.Thread):
+    """
+    Publishes the board events on a ZeroMQ PUB socket.
+
+    Each event is sent as a two-part message: the event type (so that
+    subscribers can filter on it) and the msgpack-encoded event dict.
+    """
+
+    daemon = True
+    parent = None
+    addresses = None
+    packer = MsgPackSerializer
+
+    def __init__(self, parent, addresses):
+        self.parent = parent
+        self.addresses = addresses
+        super(EventsPublisherThread, self).__init__()
+        self._queue = Queue.Queue(maxsize=EVENTS_QUEUE_SIZE)
+
+    def publish(self, event):
+        """Queue an event for publishing. Thread-safe."""
+        try:
+            self._queue.put_nowait(event)
+        except Queue.Full:
+            pass
+
+    def run(self):
+        socket = zmq.Context.instance().socket(zmq.PUB)
+        for address in self.addresses:
+            socket.bind(address)
+        while True:
+            event = self._queue.get()
+            socket.send_multipart([event['type'], self.packer.packb(event)])
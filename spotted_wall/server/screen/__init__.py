@@ -2,20 +2,42 @@
 The PyGame-powered screen
 """
 
+import heapq
 import pygame
 import time
 import threading
 
-from .message import Message
+from .message import Message, compute_timings, PRIORITIES, \
+    DEFAULT_PRIORITY
+from .renderer import Scene, FullRenderer, DirtyRectRenderer
+from .scheduler import FrameScheduler
+from .store import MessageStore
+from .layout import MessagesLayout
+from .backends import DisplayBackend, HeadlessBackend
+from .prerender import PrerenderPool, PRERENDER_WORKERS
+from .surfaces import SurfacesBudget, SURFACES_BUDGET
+from .tiles import LocalTileOutput, get_canvas_size, REFRESH_INTERVAL, \
+    MESSAGES_FONT, SERVICE_FONT, SERVICE_FONT_SIZE, SERVICE_COLOR
 
 ## Some default configuration for the screen
-from spotted_wall.server.utils import lazy_property, Counter
+from spotted_wall.server.events import EventsDispatcher, EV_ADDED, \
+    EV_UPDATED, EV_STATE_CHANGED, EV_EXPIRED, EV_DELETED
+from spotted_wall.server.stats import stats
+from spotted_wall.server.admission import Backlog, MAX_BACKLOG, \
+    OVERFLOW_POLICY
+from spotted_wall.server.utils import lazy_property, rendered_lines_cache, \
+    get_text_widths_caches, pygame_color_to_hex
 
 SCREEN_PADDING = 40
 MESSAGES_PADDING = 40
 FONT_SIZE = 40
 FRAME_RATE = 60
 SHOW_FPS = True
+
+## New messages are rendered in background only if they're within
+## this many positions from the top of the queue; the others will
+## be rendered when their turn comes, to save memory.
+PRERENDER_AHEAD = 64
 DEBUG = True
 
 
@@ -35,46 +57,125 @@ class SpottedWallScreen(object):
                  rpc_server_address=None,
                  enable_web_ui=False,
                  web_ui_address=None,
-                 messages_font_size=FONT_SIZE):
-
-        ## Container for the messages
-        self.messages = {}
-
-        ## threading.Lock() for access to the messages list
-        self._msgs_access_lock = threading.Lock()
-
-        ## Counter yielding message ids. Just call .next() to get one.
-        self.message_id = Counter()
+                 messages_font_size=FONT_SIZE,
+                 dirty_rects=True,
+                 headless=False,
+                 prerender_workers=PRERENDER_WORKERS,
+                 canvas_size=None,
+                 tiles=None,
+                 surfaces_budget=SURFACES_BUDGET,
+                 max_backlog=MAX_BACKLOG,
+                 overflow_policy=OVERFLOW_POLICY):
+
+        ## Timings of the hot paths, and caches usage
+        self.stats = stats
+        self.stats.register_cache('rendered_lines',
+                                  lambda: rendered_lines_cache)
+        self.stats.register_cache('text_widths', get_text_widths_caches)
+
+        ## Memory taken by the rendered messages
+        self.surfaces = SurfacesBudget(max_size=surfaces_budget)
+        self.stats.register_gauge('surfaces', self.surfaces.get_usage)
+
+        ## Container for the messages. Writers publish new versions
+        ## of it, while each frame is drawn from a snapshot.
+        self.store = MessageStore(stats=self.stats)
+
+        ## Limits the number of messages in the store (0: no limit)
+        self.backlog = None
+        if max_backlog:
+            self.backlog = Backlog(max_backlog, overflow=overflow_policy)
+            self.stats.register_gauge('backlog', self.backlog.get_usage)
+
+        ## Min-heap of (expire_time, message_id), plus the last
+        ## expire time we pushed for each message.
+        self._expiry_heap = []
+        self._expiry_scheduled = {}
+
+        ## Events about changes on the board, plus the last state
+        ## we reported for each message still on the board.
+        self.events = EventsDispatcher()
+        self._message_states = {}
+
+        ## Decides when to draw the next frame
+        self.scheduler = FrameScheduler(frame_rate=FRAME_RATE)
+
+        ## Renders new messages in background
+        self.prerender = None
+        if prerender_workers:
+            self.prerender = PrerenderPool(
+                workers=prerender_workers, on_done=self.scheduler.wake,
+                surfaces=self.surfaces, store=self.store)
+
+        ## Works out which messages are visible, and where
+        self.layout = MessagesLayout(
+            padding=SCREEN_PADDING, spacing=MESSAGES_PADDING,
+            prerender=self.prerender, surfaces=self.surfaces)
+
+        ## Where to draw: a real window, or an offscreen surface
+        if headless:
+            self.backend = HeadlessBackend()
+        else:
+            self.backend = DisplayBackend()
 
         ## Initialize pygame
-        pygame.init()
+        self.backend.init()
 
         ## The clock, used to calculate FPS etc.
         self.clock = pygame.time.Clock()
 
+        ## The renderer: either redraw everything on each frame, or
+        ## just update the regions that changed.
+        if dirty_rects:
+            self.renderer = DirtyRectRenderer()
+        else:
+            self.renderer = FullRenderer()
+        self._labels_cache = {}
+
+        ## Tiled output: the layout is computed on a virtual canvas,
+        ## and each tile draws a region of it on the local window.
+        ## More outputs (eg. remote tiles) can be added later.
+        self.tiles = [LocalTileOutput(tile, dirty_rects=dirty_rects)
+                      for tile in tiles or []]
+        if canvas_size is None and tiles:
+            canvas_size = get_canvas_size(tiles)
+        self.canvas_size = canvas_size
+        self.outputs = []
+
         ## Prepare screen resolution sizes
         self._window_res = initial_size
-        self._fullscreen_res = max(pygame.display.list_modes())
+        self._fullscreen_res = initial_size
+        _modes = self.backend.list_modes()
+        if isinstance(_modes, list) and _modes:
+            self._fullscreen_res = max(_modes)
 
         ## Set the desired fullscreen mode
         self._set_video_mode(fullscreen=fullscreen)
 
         ## Set window title
-        pygame.display.set_caption("Spotted Wall (main window)")
+        self.backend.set_caption("Spotted Wall (main window)")
 
         ## Some extra configuration options
         self._messages_font_size = messages_font_size
         self.show_fps = show_fps
-        self.show_clock = True
+        self.show_clock = show_clock
 
     def list_screen_resolutions(self):
         """
         List the available video modes
         """
-        return pygame.display.list_modes()
+        return self.backend.list_modes()
+
+    @property
+    def messages(self):
+        """Snapshot of the messages, as a ``{id: message}`` dict"""
+        return self.store.snapshot()
 
     @property
     def size(self):
+        """Size of the area where messages are laid out"""
+        if self.canvas_size is not None:
+            return self.canvas_size
         return self.screen.get_size()
 
     @property
@@ -104,24 +205,31 @@ class SpottedWallScreen(object):
         :param fullscreen:
             Whether to go fullscreen or not.
         """
-        _screen_flags = pygame.DOUBLEBUF | pygame.RESIZABLE
         self._fullscreen = fullscreen
         if resolution is None:
             resolution = self._fullscreen_res \
                 if fullscreen else self._window_res
         if fullscreen:
-            _screen_flags |= pygame.FULLSCREEN
             self._fullscreen_res = resolution
         else:
             self._window_res = resolution
-        self.screen = pygame.display.set_mode(resolution, _screen_flags)
+        self.screen = self.backend.set_mode(resolution, fullscreen)
+        self.renderer.invalidate()
+        for output in self.tiles:
+            output.set_target(self.screen)
 
     def toggle_fullscreen(self):
         self._set_video_mode(fullscreen=not self._fullscreen)
 
     def _check_events(self):
-        """Process all the new pygame events"""
+        """
+        Process all the new pygame events.
+
+        :return: True if a redraw is needed
+        """
 
+        redraw = False
+        resize = None
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 pass  # todo: use some kind of event to signal we want to quit?
@@ -130,153 +238,453 @@ class SpottedWallScreen(object):
             if event.type == pygame.KEYDOWN:
                 if event.key in (pygame.K_f, pygame.K_F11):
                     self.toggle_fullscreen()
+                    redraw = True
 
                 # elif event.key == pygame.K_q:
                 #     pass
 
             elif event.type == pygame.VIDEORESIZE:
-                self._set_video_mode(event.size, self._fullscreen)
+                ## While dragging the window border, events come in
+                ## bursts: only the last one matters.
+                resize = event.size
+
+            elif event.type == pygame.VIDEOEXPOSE:
+                self.renderer.invalidate()
+                for output in self.tiles:
+                    output.invalidate()
+                redraw = True
+
+        if resize is not None:
+            ## Messages are not wrapped again right away, see
+            ## MessagesLayout
+            self._set_video_mode(resize, self._fullscreen)
+            redraw = True
+
+        return redraw
+
+    def _schedule_expiry(self, message_id, message):
+        """Keep track of when a (visible) message is going to expire"""
+        expire_time = message.get_expire_time()
+        if expire_time is None:
+            return
+        if self._expiry_scheduled.get(message_id) != expire_time:
+            self._expiry_scheduled[message_id] = expire_time
+            heapq.heappush(self._expiry_heap, (expire_time, message_id))
 
     def _cleanup_messages(self):
-        """Cleanup the expired messages from queue"""
-        with self._msgs_access_lock:
-            for k in self.messages.keys():  # *NOT* iterkeys() !!
-                if self.messages[k].is_expired():
-                    del self.messages[k]
-
-    def _draw_messages(self):
-        with self._msgs_access_lock:
-            _filled_space = SCREEN_PADDING
-            messages_iterator = iter(sorted(self.messages.iteritems()))
-            _shown_messages = 0
-
-            while True:  # Loop until we finish space or messages..
-
-                try:
-                    message_id, message = messages_iterator.next()
-                except StopIteration:
-                    break  # no more messages..
-
-                message_width = self.width - (2 * SCREEN_PADDING)
-                req_space = \
-                    _filled_space + message.get_height(message_width) \
-                    + SCREEN_PADDING
-
-                ## We make sure we draw at least one message no matter its
-                ## length, to avoid jamming up the queue..
-                if (req_space > self.height) and (_shown_messages > 0):
-                    message.pause()
-                    for message_id, message in messages_iterator:
-                        message.pause()
-                    break  # no more space..
-
-                message.resume()  # make sure it's not paused..
-                rendered = message.render(message_width)
-                _shown_messages += 1
-
-                if isinstance(rendered, (float, int)):
-                    _filled_space += int(rendered *
-                                         (message.height + MESSAGES_PADDING))
-
-                else:
-                    self.screen.blit(rendered, (SCREEN_PADDING, _filled_space))
-                    _filled_space += rendered.get_height() + MESSAGES_PADDING
-
-    def _draw_fps(self):
+        """
+        Cleanup the expired messages from queue.
+
+        Only the messages whose expire time has passed are checked;
+        entries in the heap become stale when a message gets paused,
+        resumed or updated, and are simply discarded.
+        """
+        messages = self.store.snapshot()
+        now = time.time()
+        expired = []
+
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            expire_time, message_id = heapq.heappop(self._expiry_heap)
+            if self._expiry_scheduled.get(message_id) != expire_time:
+                continue  # Stale entry
+            del self._expiry_scheduled[message_id]
+
+            message = messages.get(message_id)
+            if message is None:
+                continue  # Already deleted
+            if message.is_expired(now):
+                expired.append(message_id)
+            else:
+                self._schedule_expiry(message_id, message)
+
+        if expired:
+            self.store.remove(expired)
+            self.surfaces.discard(expired)
+            for message_id in expired:
+                self._message_states.pop(message_id, None)
+                self.events.emit(EV_EXPIRED, message_id)
+
+    def _draw_messages(self, scene):
+        message_width = self.layout.get_message_width(self.width)
+        now = time.time()
+        snapshot = self.store.snapshot()
+        slots = self.layout.compute(snapshot, self.width, self.height, now=now)
+        self.scheduler.schedule(self.layout.get_next_change_time(now))
+
+        ## The last state reported for each message is kept until it
+        ## expires or gets deleted, not only while it is visible:
+        ## a message scrolling off and back didn't change state.
+        states = self._message_states
+        if len(states) > len(snapshot):
+            ## Deleted while being drawn
+            for message_id in list(states):
+                if message_id not in snapshot:
+                    states.pop(message_id, None)
+
+        ## States and alphas of the whole frame, at the same time
+        timings = compute_timings(
+            [message for message_id, message, top in slots], now)
+
+        for (message_id, message, top), timing in zip(slots, timings):
+            state, level, next_change = timing
+            message.width = message_width
+            self.scheduler.schedule(next_change)
+            self._schedule_expiry(message_id, message)
+
+            if states.get(message_id) != state:
+                states[message_id] = state
+                self.events.emit(EV_STATE_CHANGED, message_id, state=state)
+
+            if level is not None:
+                source = None
+                if self.outputs:
+                    source = ('message', message.text,
+                              pygame_color_to_hex(message.color),
+                              message_width, self._messages_font_size, level)
+                scene.blit(('message', message_id),
+                           message.render_faded(level, preview=True),
+                           (SCREEN_PADDING, top), source=source)
+
+    def _render_label(self, text):
+        """Render a service label, reusing the last one if unchanged"""
+        if text not in self._labels_cache:
+            if len(self._labels_cache) > 16:
+                self._labels_cache.clear()
+            self._labels_cache[text] = self.service_font.render(
+                text, True, SERVICE_COLOR)
+        return self._labels_cache[text]
+
+    def _draw_fps(self, scene):
         if self.show_fps:
             fps = self.clock.get_fps()
-            fpslabel = self.service_font.render(
-                str(int(fps)), True, (255, 255, 255))
+            fpslabel = self._render_label(str(int(fps)))
             rec = fpslabel.get_rect(top=5, right=self.width - 5)
-            self.screen.blit(fpslabel, rec)
+            scene.blit('fps', fpslabel, rec, source=('label', str(int(fps))))
 
-    def _draw_clock(self):
+    def _draw_clock(self, scene):
         if self.show_clock:
-            clock_time = time.strftime('%T')
-            clock_label = self.service_font.render(
-                clock_time, True, (255, 255, 255))
+            now = time.time()
+            clock_time = time.strftime('%T', time.localtime(now))
+            self.scheduler.schedule(int(now) + 1)
+            clock_label = self._render_label(clock_time)
             rec = clock_label.get_rect(
                 bottom=self.height - 5, centerx=self.width/2)
-            self.screen.blit(clock_label, rec)
+            scene.blit('clock', clock_label, rec, source=('label', clock_time))
+
+    def _draw_frame(self):
+        """Draw a frame, updating only the changed parts of the display"""
+        timer = self.stats.timer
+        scene = Scene()
+        with timer('frame.messages'):
+            self._draw_messages(scene)
+        with timer('frame.fps'):
+            self._draw_fps(scene)
+        with timer('frame.clock'):
+            self._draw_clock(scene)
+        with timer('frame.render'):
+            if self.tiles:
+                rects = []
+                for output in self.tiles:
+                    rects.extend(output.render(scene))
+            else:
+                rects = self.renderer.render(self.screen, scene)
+        if self.outputs:
+            with timer('frame.outputs'):
+                for output in self.outputs:
+                    output.render(scene)
+            self.scheduler.schedule(time.time() + REFRESH_INTERVAL)
+        if rects:
+            with timer('frame.update'):
+                self.backend.update(rects)
+
+    def draw_frame(self):
+        """Cleanup the expired messages, then draw a frame"""
+        with self.stats.timer('frame.total'):
+            with self.stats.timer('frame.cleanup'):
+                self._cleanup_messages()
+            self._draw_frame()
 
     def _main_loop(self):
         """Application main loop"""
+        frame_due = True
         while 1:
-            self._check_events()
-            self._cleanup_messages()
-            self.screen.fill((0, 0, 0))
-            self._draw_messages()
-            self._draw_fps()
-            self._draw_clock()
-            pygame.display.flip()
-            self.clock.tick(FRAME_RATE)
+            with self.stats.timer('frame.events'):
+                events_redraw = self._check_events()
+            if events_redraw:
+                frame_due = True
+            if frame_due:
+                self.draw_frame()
+                self.clock.tick(self.scheduler.frame_rate)
+            frame_due = self.scheduler.wait()
 
     @lazy_property
     def service_font(self):
-        return pygame.font.SysFont('monospace', 16)
+        return pygame.font.SysFont(SERVICE_FONT, SERVICE_FONT_SIZE)
 
     @lazy_property
     def messages_font(self):
-        return pygame.font.SysFont('monospace', self._messages_font_size)
+        return pygame.font.SysFont(MESSAGES_FONT, self._messages_font_size)
+
+    def add_output(self, output):
+        """
+        Add an extra output, getting the scene of each frame
+        (eg. a :py:class:`.tiles.RemoteTilesOutput`).
+        """
+        self.outputs.append(output)
+        self.scheduler.wake()
 
     ##--------------------------------------------------------------------------
     ## Public interface
     ##--------------------------------------------------------------------------
 
-    def add_message(self, text, color=None, duration=None):
-        """Add a message to the wall"""
+    def _notify(self, event_type, message_ids):
+        """
+        Emit events about changed messages, queue them for rendering
+        and wake up the main loop.
+        """
 
-        with self._msgs_access_lock:
-            print "Added message: {} {} {}".format(text, color, duration)
-            message = Message(text, font=self.messages_font, color=color)
+        snapshot = self.store.snapshot()
+
+        if self.prerender is not None and \
+                event_type in (EV_ADDED, EV_UPDATED):
+            message_width = self.layout.get_message_width(self.width)
+            for message_id in message_ids:
+                if message_id in snapshot and \
+                        snapshot.position(message_id) < PRERENDER_AHEAD:
+                    self.prerender.submit(snapshot[message_id], message_width,
+                                          message_id)
+
+        if event_type == EV_DELETED:
+            self.surfaces.discard(message_ids)
+            for message_id in message_ids:
+                self._message_states.pop(message_id, None)
+
+        if self.events:
+            for message_id in message_ids:
+                data = {}
+                if event_type in (EV_ADDED, EV_UPDATED):
+                    if message_id not in snapshot:
+                        continue
+                    data['message'] = snapshot[message_id].to_dict()
+                self.events.emit(event_type, message_id, **data)
+
+        self.scheduler.wake()
+
+    def _create_message(self, text, color=None, duration=None,
+                        priority=None):
+        message = Message(text, font=self.messages_font, color=color,
+                          priority=priority or DEFAULT_PRIORITY)
+
+        if duration is not None:
+            message.max_show_time = duration
+        else:
+            message.max_show_time = 10 + int(len(text) * .1)
 
-            if duration is not None:
-                message.max_show_time = duration
-            else:
-                message.max_show_time = 10 + int(len(text) * .1)
+        return message
+
+    def add_message(self, text, color=None, duration=None, priority=None):
+        """
+        Add a message to the wall.
 
-            message_id = self.message_id.next()
-            self.messages[message_id] = message
-            return message_id
+        :param priority: Its priority class, one of
+            :py:data:`.message.PRIORITIES` (default: normal)
+        :raises BacklogFull: if the message was not let in, see
+            :py:class:`spotted_wall.server.admission.Backlog`
+        """
 
-    def list_messages(self):
-        """List all the messages"""
+        print "Added message: {} {} {}".format(text, color, duration)
+        results = self._add_messages([self._create_message(
+            text, color=color, duration=duration, priority=priority)])[0]
+        result = results[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
 
-        with self._msgs_access_lock:
-            for message_id, message in self.messages.iteritems():
-                msg = message.to_dict()
-                msg['id'] = message_id
-                yield msg
+    def add_messages(self, messages):
+        """
+        Add several messages to the wall at once.
+
+        :param messages: A list of dicts, containing the
+            :py:meth:`add_message` arguments.
+        :return: The list of new message ids; None for the messages
+            not let in, as the backlog was full.
+        """
 
-    def get_message(self, message_id):
+        new_messages = [self._create_message(**msg) for msg in messages]
+        results, added = self._add_messages(new_messages)
+        print "Added {} messages".format(added)
+        return [None if isinstance(result, Exception) else result
+                for result in results]
+
+    def _add_messages(self, new_messages):
+        """
+        Add some messages, going through the backlog.
+
+        :return: a ``(results, added)`` tuple: ``results`` has, for
+            each message, its id (or the id of the message it was
+            merged into), or the exception telling why it was not
+            added; ``added`` is the number of messages actually added.
+        """
+
+        if self.backlog is None:
+            message_ids = self.store.add_many(new_messages)
+            self._notify(EV_ADDED, message_ids)
+            return message_ids, len(message_ids)
+
+        with self.backlog.lock:
+            decisions, dropped = self.backlog.admit(
+                self.store.snapshot(), new_messages)
+            admitted = [message for message, decision
+                        in zip(new_messages, decisions) if decision is None]
+            message_ids = []
+            if admitted:  # Don't publish a new version for nothing
+                message_ids = self.store.add_many(admitted, remove=dropped)
+
+        if dropped:
+            self._notify(EV_DELETED, dropped)
+        if message_ids:
+            self._notify(EV_ADDED, message_ids)
+        new_ids = iter(message_ids)
+        results = [next(new_ids) if decision is None else decision
+                   for decision in decisions]
+        return results, len(message_ids)
+
+    def dump_messages(self):
+        """
+        Export all the messages, eg. to be persisted.
+
+        :return: a ``(messages, next_id)`` tuple, where messages is
+            a list of ``(message_id, message_dict)`` tuples.
+        """
+        messages = [(message_id, message.to_dict())
+                    for message_id, message
+                    in self.store.snapshot().iteritems()]
+        return messages, self.store.next_id
+
+    def restore_messages(self, messages, next_id):
+        """
+        Replace the messages with the ones from a dump, as returned
+        by :py:meth:`dump_messages`. Messages that were about to
+        expire are discarded.
+        """
+        restored = []
+        for message_id, data in messages:
+            message = Message.from_dict(data, font=self.messages_font)
+            if message.max_show_time > 0:
+                restored.append((message_id, message))
+        self.store.restore(restored, next_id)
+        self.surfaces.clear()
+        self.scheduler.wake()
+        return [message_id for message_id, _ in restored]
+
+    def list_messages(self, offset=0, limit=None, since_id=None,
+                      since_key=None, fields=None):
+        """
+        List the messages, in display order: by priority, then by id.
+
+        :param offset: Number of messages to skip
+        :param limit: Maximum number of messages to return
+        :param since_id: Only list messages with an id greater than this,
+            eg. the highest id received, to get the ones added since.
+            Not meant for paging: messages are not listed by id.
+        :param since_key: Only list messages after this one, as a
+            ``(priority, id)`` pair; pass the last message received
+            to get the next page.
+        :param fields: Only return these fields (plus the id),
+            see :py:meth:`Message.to_dict`.
+        """
+
+        snapshot = self.store.snapshot()
+        order = snapshot.order
+        if since_key is not None:
+            priority, message_id = since_key
+            if priority not in PRIORITIES:
+                raise ValueError("Invalid priority: {0!r}".format(priority))
+            order = snapshot.order_after(PRIORITIES.index(priority),
+                                         message_id)
+        if since_id is not None:
+            order = [message_id for message_id in order
+                     if message_id > since_id]
+        stop = None if limit is None else offset + limit
+
+        for message_id in order[offset:stop]:
+            msg = snapshot[message_id].to_dict(fields=fields)
+            msg['id'] = message_id
+            yield msg
+
+    def get_message(self, message_id, fields=None):
         """Get the contents of a given message, by id"""
-        with self._msgs_access_lock:
-            message = self.messages[message_id]
-            msg = message.to_dict()
+        msg = self.store.get(message_id).to_dict(fields=fields)
         msg['id'] = message_id
         return msg
 
     def delete_message(self, message_id, immediate=False):
         """Delete or fade out a message"""
 
-        with self._msgs_access_lock:
-            if immediate:
-                del self.messages[message_id]
-            else:
-                self.messages[message_id].fadeOut()
+        if immediate:
+            if message_id not in self.store:
+                raise KeyError(message_id)
+            self.store.remove([message_id])
+            self._notify(EV_DELETED, [message_id])
+        else:
+            self.store.modify(message_id, lambda m: m.fadeOut())
+            self._notify(EV_UPDATED, [message_id])
+
+    def delete_messages(self, message_ids, immediate=False):
+        """
+        Delete or fade out several messages at once.
+
+        :return: A list of booleans, telling whether each
+            message was found.
+        """
+
+        if immediate:
+            snapshot = self.store.snapshot()
+            results = [message_id in snapshot for message_id in message_ids]
+            self.store.remove(message_ids)
+            event_type = EV_DELETED
+        else:
+            results = self.store.modify_many(
+                [(message_id, lambda m: m.fadeOut())
+                 for message_id in message_ids])
+            event_type = EV_UPDATED
+        self._notify(event_type, [message_id for message_id, found
+                                  in zip(message_ids, results) if found])
+        return results
 
     def hide_message(self, message_id):
         """Delete a specific message"""
         self.delete_message(message_id, immediate=False)
 
-    def edit_message(self, message_id, values):
+    def update_message(self, message_id, values):
         """Update the selected message"""
-        self.messages[message_id].update(values)
+        self.store.modify(message_id, lambda m: m.update(values))
+        self._notify(EV_UPDATED, [message_id])
+
+    edit_message = update_message
+
+    def update_messages(self, updates):
+        """
+        Update several messages at once.
+
+        :param updates: A list of ``(message_id, values)`` pairs
+        :return: A list of booleans, telling whether each
+            message was found.
+        """
+
+        def _updater(values):
+            return lambda m: m.update(values)
+
+        results = self.store.modify_many(
+            [(message_id, _updater(values))
+             for message_id, values in updates])
+        self._notify(EV_UPDATED, [message_id for (message_id, values), found
+                                  in zip(updates, results) if found])
+        return results
 
     def flush_messages(self):
         """Empty the list of messages"""
-        with self._msgs_access_lock:
-            self.messages[:] = []
+        self._notify(EV_DELETED, self.store.clear())
 
 
 class SpottedWallScreenThread(threading.Thread):
@@ -284,10 +692,10 @@ class SpottedWallScreenThread(threading.Thread):
     daemon = True
     parent = None
 
-    def __init__(self, parent):
+    def __init__(self, parent, **kwargs):
         self.parent = parent
         super(SpottedWallScreenThread, self).__init__()
-        self.screen = SpottedWallScreen()
+        self.screen = SpottedWallScreen(**kwargs)
 
     def run(self):
         self.screen.run()
@@ -0,0 +1,63 @@
+"""
+Display backends: where the screen frames end up.
+"""
+
+import os
+
+import pygame
+
+
+class DisplayBackend(object):
+    """Draws on a real pygame window (or the whole screen)"""
+
+    def init(self):
+        pygame.init()
+
+    def list_modes(self):
+        return pygame.display.list_modes()
+
+    def set_mode(self, resolution, fullscreen=False):
+        """Change the video mode, returning the surface to draw on"""
+        flags = pygame.DOUBLEBUF | pygame.RESIZABLE
+        if fullscreen:
+            flags |= pygame.FULLSCREEN
+        return pygame.display.set_mode(resolution, flags)
+
+    def set_caption(self, caption):
+        pygame.display.set_caption(caption)
+
+    def update(self, rects):
+        """Push the given regions of the surface to the display"""
+        pygame.display.update(rects)
+
+
+class HeadlessBackend(DisplayBackend):
+    """
+    Draws on an offscreen surface, without the need for a display.
+
+    Uses the SDL "dummy" video driver, so that events, fonts and
+    ``Surface.convert()`` keep working; the frames can be inspected
+    via the :py:attr:`surface` attribute.
+    """
+
+    surface = None
+
+    def init(self):
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+        pygame.init()
+        ## We need a display mode set, for surfaces to be converted
+        ## to its pixel format.
+        pygame.display.set_mode((1, 1))
+
+    def list_modes(self):
+        return []
+
+    def set_mode(self, resolution, fullscreen=False):
+        self.surface = pygame.Surface(resolution)
+        return self.surface
+
+    def set_caption(self, caption):
+        pass
+
+    def update(self, rects):
+        pass
@@ -0,0 +1,40 @@
+"""
+Helpers for fading surfaces in and out, cheaply.
+
+Instead of setting a per-surface alpha on the (shared) rendered
+surface and having it blended on each frame, we prepare an opaque
+variant of it, pre-blended against the (black) background, for each
+alpha level; levels are quantised, so a fade only needs a few of
+them, and frames in between don't need to be redrawn at all.
+"""
+
+import pygame
+
+## Number of distinct alpha levels used for fades
+ALPHA_STEPS = 32
+
+
+def quantize_alpha(alpha, steps=ALPHA_STEPS):
+    """Convert a 0-1 alpha to one of ``steps`` levels in the 0-255 range"""
+    alpha = min(1., max(0., alpha))
+    return int(round(alpha * steps)) * 255 // steps
+
+
+def to_display_format(surface):
+    """
+    Convert a surface to the pixel format of the display, so it
+    can be blitted as fast as possible (if a display is set).
+    """
+    if pygame.display.get_surface() is None:
+        return surface
+    return surface.convert()
+
+
+def fade_surface(surface, level):
+    """
+    Return an opaque copy of a surface, as it would appear blended
+    with the given alpha level (0-255) on a black background.
+    """
+    faded = surface.copy()
+    faded.fill((level, level, level), special_flags=pygame.BLEND_RGB_MULT)
+    return faded
@@ -0,0 +1,238 @@
+"""
+Layout of the messages on the screen.
+"""
+
+import time
+
+SCREEN_PADDING = 40
+MESSAGES_PADDING = 40
+
+## Messages moving up (eg. when one above them disappears) slide to
+## their new position in this time, with this easing.
+MOVE_TIME = 1.
+MOVE_EASING = lambda x: x * x * (3 - 2 * x)  # Smoothstep
+
+## After the width changes (eg. while the window is being resized),
+## messages are wrapped again only once it stayed the same this long;
+## in the meantime, their old surfaces are scaled to fit.
+RESIZE_DELAY = .3
+
+
+class LayoutAnimator(object):
+    """
+    Moves items smoothly towards their target position.
+
+    Each item has a target ``top``; when it changes, the item is
+    moved there from wherever it is now, over ``duration`` seconds.
+    Only upward moves are animated: items moving down (eg. because
+    the one above grew taller) jump there at once, or they would
+    overlap it for a while.
+    """
+
+    def __init__(self, duration=MOVE_TIME, easing=MOVE_EASING):
+        self.duration = duration
+        self.easing = easing
+
+        ## {key: (from_top, to_top, start_time)}
+        self._moves = {}
+
+    def reset(self):
+        """Forget all the positions, eg. after a resize"""
+        self._moves = {}
+
+    def _get_position(self, move, now):
+        from_top, to_top, start_time = move
+        progress = (now - start_time) / self.duration
+        if progress >= 1:
+            return to_top
+        return from_top + (to_top - from_top) * self.easing(max(0., progress))
+
+    def place(self, key, target, now):
+        """Return the current (integer) top of an item"""
+        move = self._moves.get(key)
+        if move is None or target > self._get_position(move, now):
+            move = (target, target, now)
+            self._moves[key] = move
+        elif move[1] != target:
+            move = (self._get_position(move, now), target, now)
+            self._moves[key] = move
+        return int(round(self._get_position(move, now)))
+
+    def forget(self, keys):
+        """Drop all the items but the given ones"""
+        for key in self._moves.keys():
+            if key not in keys:
+                del self._moves[key]
+
+    def is_moving(self, now):
+        return any(now - start_time < self.duration and from_top != to_top
+                   for from_top, to_top, start_time
+                   in self._moves.itervalues())
+
+    def get_next_change_time(self, now):
+        """A frame is needed right away, if anything is still moving"""
+        if self.is_moving(now):
+            return now
+        return None
+
+
+class MessagesLayout(object):
+    """
+    Works out which messages fit on the screen, and where.
+
+    Messages are stacked from the top, in order, until we run out
+    of space; the remaining ones are paused, waiting for their turn.
+    Since the visible window always starts from the first message,
+    each frame we only need to measure the visible messages plus
+    the first one that doesn't fit, no matter how many are queued.
+
+    The visible window of the previous frame is kept, so messages
+    get paused / resumed only when they cross its boundary.
+
+    If a pre-rendering pool is given, messages not yet shown are
+    rendered in the background: the window stops at the first one
+    that is not ready yet (or skips it, if it came before messages
+    already shown, eg. as it has a higher priority).
+
+    Positions go through a :py:class:`LayoutAnimator`, so messages
+    slide up when space frees above them; no new message is let in
+    while they're still moving.
+
+    The surfaces of the measured and visible messages are accounted
+    for in ``surfaces`` (a :py:class:`.surfaces.SurfacesBudget`), if
+    passed, so the ones gone off-screen get released first.
+
+    When the width changes, messages keep their old surfaces, scaled,
+    until it settles for ``resize_delay`` seconds; then they're
+    wrapped again (in the background, if possible), in order, so the
+    visible ones come first. New messages, having nothing to scale,
+    are rendered for the current width right away.
+    """
+
+    def __init__(self, padding=SCREEN_PADDING, spacing=MESSAGES_PADDING,
+                 prerender=None, animator=None, surfaces=None,
+                 resize_delay=RESIZE_DELAY):
+        self.padding = padding
+        self.spacing = spacing
+        self.prerender = prerender
+        self.animator = animator or LayoutAnimator()
+        self.surfaces = surfaces
+        self.resize_delay = resize_delay
+
+        ## {message_id: message} visible in the last frame
+        self._visible = {}
+        self._width = None
+        self._resized_at = None
+
+    def get_message_width(self, width):
+        return width - (2 * self.padding)
+
+    def get_next_change_time(self, now=None):
+        if now is None:
+            now = time.time()
+        next_time = self.animator.get_next_change_time(now)
+        if self._resized_at is not None:
+            settle_time = self._resized_at + self.resize_delay
+            if next_time is None or settle_time < next_time:
+                next_time = settle_time
+        return next_time
+
+    def _get_height(self, message_id, message, width, settled):
+        """
+        Measure a message, using the scaled preview while resizing,
+        or while it is being wrapped again in the background.
+        """
+        if message.has_preview(width) and \
+                (not settled or self.prerender is not None):
+            if settled:
+                self.prerender.submit(message, width, message_id)
+            message.width = width
+            return message.get_preview_height(width)
+        return message.get_height(width)
+
+    def compute(self, messages, width, height, now=None):
+        """
+        Compute the layout for a frame.
+
+        :param messages: The messages snapshot, iterated in order
+        :param width: Width of the screen
+        :param height: Height of the screen
+        :param now: Time of the frame (defaults to now)
+        :return: a list of ``(message_id, message, top)`` tuples
+            for the messages to be drawn.
+        """
+
+        if now is None:
+            now = time.time()
+        message_width = self.get_message_width(width)
+        if width != self._width:
+            if self._width is not None:
+                self._resized_at = now
+            self._width = width
+            self.animator.reset()  # Don't animate resizes
+            if self.prerender is not None:
+                self.prerender.set_width(message_width)
+
+        settled = self._resized_at is None or \
+            now - self._resized_at >= self.resize_delay
+        if settled:
+            self._resized_at = None
+
+        filled_space = self.padding
+        visible = {}
+        slots = []
+        moving = False
+
+        ## Messages shown in the last frame, not reached yet
+        ahead = sum(1 for message_id in self._visible
+                    if message_id in messages)
+
+        for message_id, message in messages.iteritems():
+            if message_id in self._visible:
+                ahead -= 1
+            elif moving:
+                break  # wait for the others to settle..
+
+            if (self.prerender is not None) and (message.shown_at is None) \
+                    and not message.is_rendered(message_width) \
+                    and (settled or not message.has_preview(message_width)):
+                ## While resizing, the ones never rendered are rendered
+                ## anyway: they have no preview to show meanwhile
+                self.prerender.submit(message, message_width, message_id)
+                if ahead:
+                    continue  # don't hide the ones already shown
+                break  # wait for it to be ready..
+
+            message_height = self._get_height(
+                message_id, message, message_width, settled)
+            req_space = filled_space + message_height + self.padding
+            if self.surfaces is not None:
+                self.surfaces.update(message_id, message)
+
+            ## We make sure we draw at least one message no matter its
+            ## length, to avoid jamming up the queue..
+            if (req_space > height) and slots:
+                break  # no more space..
+
+            if self._visible.get(message_id) is not message:
+                message.resume(now)  # make sure it's not paused..
+            message.show(now)
+
+            top = self.animator.place(message_id, filled_space, now)
+            moving = moving or (top != filled_space)
+            visible[message_id] = message
+            slots.append((message_id, message, top))
+            filled_space += int(message.get_extent(now) *
+                                (message_height + self.spacing))
+
+        self.animator.forget(visible)
+
+        ## Pause the messages that just went off-screen
+        for message_id, message in self._visible.iteritems():
+            if visible.get(message_id) is not message:
+                message.pause(now)
+
+        self._visible = visible
+        if self.surfaces is not None:
+            self.surfaces.pin(visible)
+        return slots
@@ -7,7 +7,9 @@ import time
 
 import pygame
 
-from ..utils import Colors, lazy_property, wrap_pygame_text, pygame_color_to_hex
+from ..utils import Colors, wrap_pygame_text, pygame_color_to_hex, \
+    render_pygame_text, pygame_surface_size
+from .fades import quantize_alpha, to_display_format, fade_surface
 
 
 MESSAGE_MIN_SHOW_TIME = 10
@@ -21,6 +23,10 @@ FADE_IN_EASING = lambda x: x  # Linear
 FADE_OUT_EASING = lambda x: x  # Linear
 DISAPPEAR_EASING = lambda x: x  # Linear
 
+## Priority classes: messages are shown in this order, then by id
+PRIORITIES = ('high', 'normal', 'low')
+DEFAULT_PRIORITY = 'normal'
+
 SCREEN_PADDING = 40
 MESSAGES_PADDING = 40
 FONT_SIZE = 40
@@ -30,8 +36,80 @@ FRAME_RATE = 60
 colors = Colors()
 
 
+def compute_timings(messages, now=None):
+    """
+    Timing pass of a frame: work out the state, alpha level and
+    next change time of all the given messages, against a single
+    timestamp.
+
+    :return: a list of ``(state, alpha_level, next_change_time)``
+        tuples, one for each message.
+    """
+    if now is None:
+        now = time.time()
+    return [message.get_timing(now) for message in messages]
+
+
+class TimingProfile(object):
+    """
+    Timings and easing functions of the message animations.
+
+    Profiles are shared among messages: a message only keeps
+    a reference to its own.
+    """
+
+    __slots__ = ('fade_in_time', 'fade_in_easing',
+                 'fade_out_time', 'fade_out_easing',
+                 'disappear_time', 'disappear_easing')
+
+    def __init__(self, fade_in_time=FADE_IN_TIME,
+                 fade_in_easing=FADE_IN_EASING,
+                 fade_out_time=FADE_OUT_TIME,
+                 fade_out_easing=FADE_OUT_EASING,
+                 disappear_time=DISAPPEAR_TIME,
+                 disappear_easing=DISAPPEAR_EASING):
+        self.fade_in_time = fade_in_time
+        self.fade_in_easing = fade_in_easing
+        self.fade_out_time = fade_out_time
+        self.fade_out_easing = fade_out_easing
+        self.disappear_time = disappear_time
+        self.disappear_easing = disappear_easing
+
+
+DEFAULT_PROFILE = TimingProfile()
+
+
+class DisplayState(object):
+    """
+    Display state of a message, changed by the screen thread as it
+    draws it.
+
+    Shared by all the versions of a message: writers replace it with
+    an updated copy (see :py:class:`.store.MessageStore`) while it may
+    be being shown or paused, and the copy must not miss that.
+    """
+
+    __slots__ = ('shown_at', 'paused_time')
+
+    def __init__(self):
+        self.shown_at = None  # First call of .render()
+        self.paused_time = None  # Pause start time
+
+
 class Message(object):
-    """Representation of a text message"""
+    """
+    Representation of a text message.
+
+    Messages can be queued by the thousands, so they are kept
+    compact: attributes live in ``__slots__``, timings are in a
+    shared :py:class:`TimingProfile`, and the rendered surfaces
+    can be released while the message is off-screen (they'll be
+    rendered again when needed; its height is remembered).
+    """
+
+    __slots__ = ('text', 'font', '_color', '_width', 'max_show_time',
+                 '_display', 'profile', 'priority_rank',
+                 '_rendered_for', '_height_for', '_faded', '_preview')
 
     ST_NOTYET = 0
     ST_FADEIN = 1
@@ -41,16 +119,23 @@ class Message(object):
     ST_EXPIRED = 5
 
     def __init__(self, text, font=None, width=None, color=None,
-                 show_time=MESSAGE_MAX_SHOW_TIME):
+                 show_time=MESSAGE_MAX_SHOW_TIME, profile=DEFAULT_PROFILE,
+                 priority=DEFAULT_PRIORITY):
         """
         :param text: Message text
         :param font: Font in which to render the message
         :param width: The maximum width this message can take
         :param color: The color in which to render this message
         :param show_time: For how long to show the message
+        :param profile: The :py:class:`TimingProfile` of its animations
+        :param priority: The priority class, one of :py:data:`PRIORITIES`
         """
 
         self._color = None
+        self._rendered_for = None  # (width, surface)
+        self._height_for = None  # (width, height)
+        self._faded = None  # (surface, alpha level, faded surface)
+        self._preview = None  # (width, rendered surface, scaled surface)
 
         self.text = text
         self.font = font
@@ -58,44 +143,122 @@ class Message(object):
         self._width = width
 
         self.max_show_time = show_time  # For how long to show
-        self.shown_at = None  # First call of .render()
+        self._display = DisplayState()  # Shown / paused time
+
+        self.profile = profile
+        self.priority = priority
+
+    @property
+    def shown_at(self):
+        return self._display.shown_at
+
+    @shown_at.setter
+    def shown_at(self, value):
+        self._display.shown_at = value
 
-        self._paused_time = None  # Pause start time
+    @property
+    def _paused_time(self):
+        return self._display.paused_time
 
-        self._fade_in_time = FADE_IN_TIME
-        self._fade_in_easing = FADE_IN_EASING
-        self._fade_out_time = FADE_OUT_TIME
-        self._fade_out_easing = FADE_OUT_EASING
-        self._disappear_time = DISAPPEAR_TIME
-        self._disappear_easing = DISAPPEAR_EASING
+    @_paused_time.setter
+    def _paused_time(self, value):
+        self._display.paused_time = value
 
-    def get_shown_time(self):
+    @property
+    def priority(self):
+        return PRIORITIES[self.priority_rank]
+
+    @priority.setter
+    def priority(self, value):
+        if value not in PRIORITIES:
+            raise ValueError("Invalid priority: {0!r}".format(value))
+        self.priority_rank = PRIORITIES.index(value)
+
+    def get_shown_time(self, now=None):
         if self.shown_at is None:
             return 0
-        return self.get_time() - self.shown_at
+        return self.get_time(now) - self.shown_at
 
-    def get_time_left(self):
-        return self.hide_time - self.get_time()
+    def get_time_left(self, now=None):
+        return self.hide_time - self.get_time(now)
 
-    def get_state(self):
-        shown_time = self.get_shown_time()
+    def get_state(self, now=None):
+        return self._get_state_at(self.get_shown_time(now))
 
-        if shown_time == 0:
+    def _get_state_at(self, shown_time):
+        if self.shown_at is None:
             return self.ST_NOTYET
 
+        profile = self.profile
+
         if shown_time > self.max_show_time:
-            if shown_time > (self.max_show_time + self._disappear_time):
+            if shown_time > (self.max_show_time + profile.disappear_time):
                 return self.ST_EXPIRED
             return self.ST_DISAPPEARING
 
-        if shown_time > (self.max_show_time - self._fade_out_time):
+        if shown_time > (self.max_show_time - profile.fade_out_time):
             return self.ST_FADEOUT
 
-        if shown_time < self._fade_in_time:
+        if shown_time < profile.fade_in_time:
             return self.ST_FADEIN
 
         return self.ST_SHOWN
 
+    def get_next_change_time(self, now=None):
+        """
+        Return the time at which the appearance of this message will
+        change next, or None if it is not going to change by itself
+        (eg. because it is paused).
+        """
+        return self.get_timing(now)[2]
+
+    def get_timing(self, now=None):
+        """
+        Work out, in one go, everything a frame needs to know about
+        the message at a given time.
+
+        :return: a ``(state, alpha_level, next_change_time)`` tuple;
+            see :py:meth:`get_alpha_level` and
+            :py:meth:`get_next_change_time`.
+        """
+        if now is None:
+            now = time.time()
+        shown_time = self.get_shown_time(now)
+        state = self._get_state_at(shown_time)
+        profile = self.profile
+
+        if state == self.ST_FADEIN:
+            level = quantize_alpha(profile.fade_in_easing(
+                self._get_fadein_percent_at(shown_time)))
+        elif state == self.ST_SHOWN:
+            level = 255
+        elif state == self.ST_FADEOUT:
+            level = quantize_alpha(profile.fade_out_easing(
+                self._get_fadeout_percent_at(shown_time)))
+        elif state in (self.ST_NOTYET, self.ST_EXPIRED,
+                       self.ST_DISAPPEARING):
+            level = None
+        else:
+            raise ValueError("Invalid state: %d" % state)
+
+        if self._paused_time is not None:
+            next_change = None
+        elif state == self.ST_SHOWN:
+            next_change = self.hide_time - profile.fade_out_time
+        else:
+            next_change = now  # Animating, or about to change state
+
+        return state, level, next_change
+
+    def get_expire_time(self):
+        """
+        Return the time at which this message will expire, or None
+        if it was not shown yet or it is paused.
+        """
+        if self.shown_at is None or self._paused_time is not None:
+            return None
+        return self.hide_time + self.profile.disappear_time
+
     @property
     def hide_time(self):
         if self.shown_at is None:
@@ -115,7 +278,7 @@ class Message(object):
         for line in text.splitlines():
             line = line.strip()
             for new_line in wrap_pygame_text(font, line, width):
-                rendered_text = font.render(new_line, True, color)
+                rendered_text = render_pygame_text(font, new_line, color)
                 rendered_lines.append(rendered_text)
 
         req_height = sum(t.get_height() for t in rendered_lines)
@@ -132,19 +295,123 @@ class Message(object):
 
         return new_surf
 
-    @lazy_property
-    def _rendered(self):
-        return self._render(
+    def _get_rendered(self, width):
+        """Return the surface rendered for the given width, cached"""
+        cached = self._rendered_for
+        if cached is not None and cached[0] == width:
+            return cached[1]
+        rendered = to_display_format(self._render(
             self.text,
-            width=self.width,
+            width=width,
             font=self.font,
-            color=self.color)
+            color=self.color))
+        ## Replaced at once, as this may be called from other threads
+        self._rendered_for = (width, rendered)
+        self._height_for = (width, rendered.get_height())
+        self._preview = None
+        return rendered
+
+    @property
+    def _rendered(self):
+        return self._get_rendered(self.width)
+
+    def is_rendered(self, width):
+        """Whether a surface for the given width is ready"""
+        cached = self._rendered_for
+        return cached is not None and cached[0] == width
+
+    def prerender(self, width):
+        """
+        Render the message for the given width, if not already done.
+        Safe to be called from a thread other than the screen one.
+        """
+        self._get_rendered(width)
+
+    def has_preview(self, width):
+        """
+        Whether, not being rendered for the given width, a surface
+        rendered for another width can be scaled to fit instead
+        (eg. while the window is being resized).
+        """
+        return self._rendered_for is not None and not self.is_rendered(width)
+
+    def _get_preview(self, width):
+        """
+        Return the surface rendered for another width, scaled down
+        to fit the given width if needed. Text is not wrapped again:
+        meant as a cheap stand-in, until rendered for the new width.
+        """
+        rendered_width, rendered = self._rendered_for
+        cached = self._preview
+        if cached is not None and cached[0] == width \
+                and cached[1] is rendered:
+            return cached[2]
+        if rendered.get_width() <= width:
+            preview = rendered
+        else:
+            scale = 1. * width / rendered.get_width()
+            preview = pygame.transform.scale(rendered, (
+                width, max(1, int(rendered.get_height() * scale))))
+        self._preview = (width, rendered, preview)
+        return preview
+
+    def get_preview_height(self, width):
+        return self._get_preview(width).get_height()
+
+    def render_faded(self, level, preview=False):
+        """
+        Return the rendered surface as it appears at the given
+        (quantised, 0-255) alpha level, reusing the last faded variant
+        if the level didn't change. The rendered surface itself is
+        never modified.
+
+        :param preview: If not rendered for the current width, use
+            the scaled preview, if any (see :py:meth:`has_preview`).
+        """
+        if preview and self.has_preview(self.width):
+            rendered = self._get_preview(self.width)
+        else:
+            rendered = self._rendered
+        if level >= 255:
+            return rendered
+        cached = self._faded
+        if cached is not None and cached[0] is rendered \
+                and cached[1] == level:
+            return cached[2]
+        faded = fade_surface(rendered, level)
+        self._faded = (rendered, level, faded)
+        return faded
+
+    def release_surfaces(self):
+        """
+        Drop the rendered surfaces, eg. while off-screen, keeping
+        the height; they'll be rendered again when needed.
+
+        :return: the number of bytes released
+        """
+        released = self.get_surfaces_size()
+        self._rendered_for = None
+        self._faded = None
+        self._preview = None
+        return released
+
+    def get_surfaces_size(self):
+        """Memory taken by the rendered surfaces, in bytes"""
+        size = 0
+        if self._rendered_for is not None:
+            size += pygame_surface_size(self._rendered_for[1])
+        if self._faded is not None:
+            size += pygame_surface_size(self._faded[2])
+        if self._preview is not None and \
+                self._preview[2] is not self._preview[1]:
+            size += pygame_surface_size(self._preview[2])
+        return size
 
     def _flush_caches(self):
-        try:
-            del self._rendered
-        except AttributeError:
-            pass
+        self._rendered_for = None
+        self._height_for = None
+        self._faded = None
+        self._preview = None
 
     @property
     def width(self):
@@ -152,8 +419,6 @@ class Message(object):
 
     @width.setter
     def width(self, value):
-        if self._width != value:
-            self._flush_caches()
         self._width = value
 
     @property
@@ -162,7 +427,6 @@ class Message(object):
 
     @color.setter
     def color(self, value):
-        print "====COLOR===>>>", value
         self._flush_caches()
         if isinstance(value, pygame.color.Color):
             self._color = value
@@ -174,48 +438,49 @@ class Message(object):
             self._color = None
 
     def get_height(self, width=None):
-        self.width = width
+        if width is not None:
+            self.width = width
+        cached = self._height_for
+        if cached is not None and cached[0] == self.width:
+            return cached[1]
         return self._rendered.get_rect().height
 
+    def get_alpha_level(self, now=None):
+        """
+        Return the current (quantised, 0-255) alpha level, or None
+        if the message is not to be drawn at all.
+        """
+        return self.get_timing(now)[1]
+
     def render(self, width=None):
-        """Return the rendered surface, with alpha applied"""
+        """
+        Return the rendered surface, with alpha applied, or 0. if
+        the message is not to be drawn.
+        """
 
         if width is not None:
-            if width != self.width:
-                self._flush_caches()
-                self.width = width
-
-        if self.shown_at is None:
-            self.shown_at = self.get_time()
+            self.width = width
 
-        msg_state = self.get_state()
-        rendered = self._rendered
+        self.show()
 
-        if msg_state == self.ST_FADEIN:
-            alpha = self._fade_in_easing(self.get_fadein_percent())
-
-        elif msg_state == self.ST_SHOWN:
-            alpha = 1
-
-        elif msg_state == self.ST_FADEOUT:
-            alpha = self._fade_out_easing(self.get_fadeout_percent())
-
-        elif msg_state in (self.ST_NOTYET, self.ST_EXPIRED):
-            #return pygame.surface.Surface((0, 0))
+        level = self.get_alpha_level()
+        if level is None:
             return 0.
+        return self.render_faded(level)
 
-        elif msg_state == self.ST_DISAPPEARING:
-            return self._disappear_easing(1. - self.get_disappear_percent())
-            # new_height = self.height * \
-            #     self._disappear_easing(1. - self.get_disappear_percent())
-            #return pygame.surface.Surface((0, new_height))
-            # return new_height
-
-        else:
-            raise ValueError("Invalid state: %d" % msg_state)
+    def show(self, now=None):
+        """Start showing the message, if not already"""
+        if self.shown_at is None:
+            self.shown_at = self.get_time(now)
 
-        rendered.set_alpha(255 * alpha)
-        return rendered
+    def get_extent(self, now=None):
+        """Return the fraction of its height taken in the layout"""
+        msg_state = self.get_state(now)
+        if msg_state in (self.ST_NOTYET, self.ST_EXPIRED):
+            return 0.
+        if msg_state == self.ST_DISAPPEARING:
+            return 0.  # The layout slides the others over it
+        return 1.
 
     def hide(self, delta=0):
         self.max_show_time = min(self.max_show_time, self.get_time() + delta)
@@ -226,59 +491,76 @@ class Message(object):
 
     @property
     def height(self):
-        return self.rect.height
+        return self.get_height()
 
-    def get_fadein_percent(self):
-        state = self.get_state()
+    def _get_fadein_percent_at(self, shown_time):
+        state = self._get_state_at(shown_time)
         if state < self.ST_FADEIN:
             return 0.
         elif state > self.ST_FADEIN:
             return 1.
-        delta = 1. * self.get_shown_time() / self._fade_in_time
+        delta = 1. * shown_time / self.profile.fade_in_time
         return min(1., max(0., delta))
 
-    def get_fadeout_percent(self):
-        state = self.get_state()
+    def _get_fadeout_percent_at(self, shown_time):
+        state = self._get_state_at(shown_time)
         if state < self.ST_FADEOUT:
             return 0.
         elif state > self.ST_FADEOUT:
             return 1.
-        delta = 1. * self.get_time_left() / self._fade_in_time
+        time_left = self.max_show_time - shown_time
+        delta = 1. * time_left / self.profile.fade_in_time
         return min(1., max(0., delta))
 
-    def get_disappear_percent(self):
-        state = self.get_state()
+    def get_fadein_percent(self, now=None):
+        return self._get_fadein_percent_at(self.get_shown_time(now))
+
+    def get_fadeout_percent(self, now=None):
+        return self._get_fadeout_percent_at(self.get_shown_time(now))
+
+    def get_disappear_percent(self, now=None):
+        shown_time = self.get_shown_time(now)
+        state = self._get_state_at(shown_time)
         if state < self.ST_DISAPPEARING:
             return 0.
         if state > self.ST_DISAPPEARING:
             return 1.
-        delta = 1. * (self.get_time() - self.hide_time) / self._disappear_time
+        delta = 1. * (shown_time - self.max_show_time) / \
+            self.profile.disappear_time
         return min(1., max(0., delta))
 
-    def is_expired(self):
-        return self.get_state() == self.ST_EXPIRED
+    def is_expired(self, now=None):
+        return self.get_state(now) == self.ST_EXPIRED
 
-    def get_time(self):
+    def get_time(self, now=None):
+        """
+        Return the message time: the given (or current) time, or the
+        time it was paused at.
+        """
         if self._paused_time is not None:
             return self._paused_time
-        return time.time()
+        if now is None:
+            return time.time()
+        return now
 
-    def pause(self):
+    def pause(self, now=None):
         if self.shown_at is None:
             return  # Ignore pause
         if self._paused_time is None:
-            self._paused_time = self.get_time()
+            self._paused_time = self.get_time(now)
 
-    def resume(self):
+    def resume(self, now=None):
         if self._paused_time is not None:
-            delta = time.time() - self._paused_time
-            self.shown_at += delta
+            if now is None:
+                now = time.time()
+            self.shown_at += now - self._paused_time
         self._paused_time = None
 
     def fadeOut(self):
         """Start the fadeOut right now.."""
         if self.get_state() < self.ST_FADEOUT:
-            self.max_show_time = self.get_shown_time() + self._fade_out_time
+            self.max_show_time = \
+                self.get_shown_time() + self.profile.fade_out_time
 
     def update(self, values):
         self._flush_caches()  #todo: only if changed..?
@@ -286,23 +568,48 @@ class Message(object):
             if key in values:
                 setattr(self, key, values[key])
         if 'max_show_time' in values:
-            self._max_show_time = values['max_show_time']
-
-    def to_dict(self, withmeta=True):
-        data = {
-            'text': self.text,
-            'color': pygame_color_to_hex(self.color),
-        }
-        if withmeta:
-            data.update({
-            '_shown_at': self.shown_at,
-            '_max_show_time': self.max_show_time,
-            '_shown_time': self.get_shown_time(),
-            })
-        return data
+            self.max_show_time = values['max_show_time']
+        if 'priority' in values:
+            self.priority = values['priority']
+
+    ## Getters for the fields exported by to_dict()
+    _dict_fields = {
+        'text': lambda self: self.text,
+        'color': lambda self: pygame_color_to_hex(self.color),
+        'priority': lambda self: self.priority,
+        'state': lambda self: self.get_state(),
+        '_shown_at': lambda self: self.shown_at,
+        '_max_show_time': lambda self: self.max_show_time,
+        '_shown_time': lambda self: self.get_shown_time(),
+    }
+
+    def to_dict(self, withmeta=True, fields=None):
+        """
+        Export the message as a dict.
+
+        :param withmeta: Whether to include the metadata (fields
+            starting with an underscore)
+        :param fields: If specified, only return these fields.
+            Unknown field names are ignored.
+        """
+        if fields is None:
+            fields = ['text', 'color', 'priority']
+            if withmeta:
+                fields.extend(['_shown_at', '_max_show_time', '_shown_time'])
+        return dict((name, self._dict_fields[name](self))
+                    for name in fields if name in self._dict_fields)
 
     @classmethod
-    def from_dict(cls, data):
-        newcls = cls(data['text'])
+    def from_dict(cls, data, **kwargs):
+        """
+        Create a message from a dict exported by :py:meth:`to_dict`.
+
+        If the metadata is present, the new message will only be
+        shown for the time it had left.
+        """
+        newcls = cls(data['text'], **kwargs)
         newcls.update(data)
+        if '_max_show_time' in data:
+            newcls.max_show_time = \
+                data['_max_show_time'] - data.get('_shown_time', 0)
         return newcls
@@ -0,0 +1,117 @@
+"""
+Background rendering of the messages, off the screen thread.
+"""
+
+import Queue
+import threading
+import traceback
+
+PRERENDER_WORKERS = 1
+
+
+class PrerenderPool(object):
+    """
+    Pool of worker threads, rendering messages before they are shown.
+
+    New and updated messages are queued here, so that wrapping and
+    rasterising their text doesn't happen in the middle of a frame;
+    the layout just waits for them to be ready.
+
+    Note that pygame holds the GIL while rendering text, so workers
+    don't render in parallel with the screen thread; they just keep
+    big bursts of new messages from stalling it for several frames.
+    """
+
+    def __init__(self, workers=PRERENDER_WORKERS, on_done=None,
+                 surfaces=None, store=None):
+        """
+        :param workers: Number of worker threads
+        :param on_done: Called (from the worker thread) each time
+            a message has been rendered.
+        :param surfaces: A :py:class:`.surfaces.SurfacesBudget`,
+            accounting for the rendered surfaces.
+        :param store: The :py:class:`.store.MessageStore` the messages
+            come from: only the ones still in it are accounted for.
+        """
+        self.workers = workers
+        self.on_done = on_done
+        self.surfaces = surfaces
+        self.store = store
+        self.width = None
+        self._queue = Queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        for i in xrange(self.workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def set_width(self, width):
+        """
+        Only render messages for this width from now on: queued ones
+        for other widths (eg. from before a resize) are skipped, or
+        rendered for this width instead if they were never rendered
+        (as they'd have nothing to show meanwhile).
+        """
+        self.width = width
+
+    def submit(self, message, width, message_id=None):
+        """
+        Queue a message to be rendered, unless already queued.
+
+        :param message_id: Id of the message, to account for its
+            surfaces in the budget.
+        """
+        if message.is_rendered(width):
+            return
+        key = (id(message), width)
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+            if not self._threads:
+                self.start()
+        self._queue.put((message, width, message_id))
+
+    def _work(self):
+        while True:
+            message, width, message_id = self._queue.get()
+            current = self.width
+            if current is not None and width != current:
+                with self._lock:
+                    self._pending.discard((id(message), width))
+                    key = (id(message), current)
+                    if message.has_preview(current) or \
+                            message.is_rendered(current) or \
+                            key in self._pending:
+                        continue  # Stale
+                    self._pending.add(key)
+                width = current
+            # noinspection PyBroadException
+            try:
+                message.prerender(width)
+                if self._is_live(message_id, message):
+                    self.surfaces.update(message_id, message)
+            except:
+                traceback.print_exc()
+            finally:
+                with self._lock:
+                    self._pending.discard((id(message), width))
+            if self.on_done is not None:
+                self.on_done()
+
+    def _is_live(self, message_id, message):
+        """
+        Whether a rendered message is to be accounted for: not if it
+        was deleted or replaced meanwhile, or we'd put it back in the
+        budget after it was discarded.
+        """
+        if self.surfaces is None or message_id is None:
+            return False
+        if self.store is None:
+            return True
+        return self.store.snapshot().get(message_id) is message
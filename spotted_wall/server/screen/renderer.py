@@ -0,0 +1,225 @@
+"""
+Renderers, drawing a frame "scene" on the display surface.
+
+The screen builds a :py:class:`Scene` for each frame, listing all the
+surfaces to be drawn and their position; the renderer then takes care
+of actually putting them on the target surface, returning the list
+of rectangles that need to be pushed to the display.
+"""
+
+from collections import Counter
+
+import pygame
+
+BACKGROUND_COLOR = (0, 0, 0)
+
+## If we end up with more dirty rectangles than this, just merge
+## them all in a single one -- updating lots of tiny rectangles
+## is slower than updating a big one.
+MAX_DIRTY_RECTS = 32
+
+## Scroll the screen contents, instead of redrawing, when at least
+## this many items moved vertically by the same amount.
+MIN_SCROLL_ITEMS = 2
+
+
+class Scene(object):
+    """The list of surfaces to be drawn in a frame"""
+
+    def __init__(self):
+        self.items = []
+        self.sources = {}
+
+    def blit(self, key, surface, pos, source=None):
+        """
+        Add a surface to the scene.
+
+        :param key: Unique identifier of the item in the scene,
+            used to track changes between frames.
+        :param surface: The surface to be drawn
+        :param pos: Either a ``(left, top)`` tuple or a ``Rect``
+        :param source: Description of how to draw the surface again
+            from scratch, for remote tiles (see :py:mod:`.tiles`).
+        """
+        if isinstance(pos, pygame.Rect):
+            pos = pos.topleft
+        rect = pygame.Rect(pos, surface.get_size())
+        self.items.append((key, surface, rect, surface.get_alpha()))
+        if source is not None:
+            self.sources[key] = source
+
+    def crop(self, region):
+        """
+        Return the part of the scene falling in a region, with
+        positions relative to its top-left corner.
+        """
+        cropped = Scene()
+        for key, surface, rect, alpha in self.items:
+            if rect.colliderect(region):
+                cropped.items.append(
+                    (key, surface, rect.move(-region.x, -region.y), alpha))
+        return cropped
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class FullRenderer(object):
+    """Redraws the whole target surface on each frame"""
+
+    def invalidate(self):
+        pass
+
+    def render(self, target, scene):
+        target.fill(BACKGROUND_COLOR)
+        for key, surface, rect, alpha in scene:
+            target.blit(surface, rect)
+        return [target.get_rect()]
+
+
+class DirtyRectRenderer(object):
+    """
+    Only redraws the regions that changed since the previous frame.
+
+    An item is considered changed if its surface object, alpha or
+    position differ from the ones drawn in the previous frame;
+    both its old and new rectangles get redrawn.
+    If nothing changed at all, nothing is drawn and an empty list
+    is returned.
+
+    When several unchanged items all moved vertically by the same
+    offset (eg. messages sliding up), the region containing them is
+    scrolled in place with a single ``Surface.scroll()``, and only
+    the strip left uncovered is redrawn.
+    """
+
+    def __init__(self):
+        self._previous = {}
+        self._invalid = True
+
+    def invalidate(self):
+        """Force a full redraw on next frame (eg. after a mode change)"""
+        self._invalid = True
+
+    def _find_scroll(self, scene, target_rect):
+        """
+        Find the items that just moved vertically by the same offset.
+
+        :return: a ``(region, dy, keys)`` tuple, or ``None``
+        """
+        moved = {}
+        for key, surface, rect, alpha in scene:
+            prev = self._previous.get(key)
+            if prev is None:
+                continue
+            prev_surface, prev_rect, prev_alpha = prev
+            if (prev_surface is surface) and (prev_alpha == alpha) \
+                    and (prev_rect.x == rect.x) and (prev_rect.y != rect.y):
+                moved[key] = (prev_rect, rect)
+        if len(moved) < MIN_SCROLL_ITEMS:
+            return None
+
+        dy, count = Counter(rect.y - prev_rect.y for prev_rect, rect
+                            in moved.itervalues()).most_common(1)[0]
+        if count < MIN_SCROLL_ITEMS:
+            return None
+
+        keys = set(key for key, (prev_rect, rect) in moved.iteritems()
+                   if rect.y - prev_rect.y == dy)
+        rects = [r for key in keys for r in moved[key]]
+        region = rects[0].unionall(rects[1:]).clip(target_rect)
+        if abs(dy) >= region.height:
+            return None
+        return region, dy, keys
+
+    def _get_dirty_rects(self, scene, scroll=None):
+        dirty = []
+        current = {}
+        scrolled = set()
+
+        if scroll is not None:
+            ## Everything else in the scrolled region got moved too,
+            ## and needs to be redrawn at both places.
+            region, dy, scrolled = scroll
+            if dy < 0:
+                dirty.append(pygame.Rect(
+                    region.left, region.bottom + dy, region.width, -dy))
+            else:
+                dirty.append(pygame.Rect(
+                    region.left, region.top, region.width, dy))
+            others = [rect for key, surface, rect, alpha in scene
+                      if key not in scrolled]
+            others.extend(rect for key, (surface, rect, alpha)
+                          in self._previous.iteritems()
+                          if key not in scrolled)
+            for rect in others:
+                if rect.colliderect(region):
+                    dirty.append(rect)
+                    dirty.append(rect.move(0, dy))
+
+        for key, surface, rect, alpha in scene:
+            current[key] = (surface, rect, alpha)
+            if key in scrolled:
+                continue
+            prev = self._previous.get(key)
+            if prev is None:
+                dirty.append(rect)
+                continue
+            prev_surface, prev_rect, prev_alpha = prev
+            if (prev_surface is not surface) or (prev_alpha != alpha) \
+                    or (prev_rect != rect):
+                dirty.append(prev_rect)
+                dirty.append(rect)
+
+        for key, (surface, rect, alpha) in self._previous.iteritems():
+            if key not in current:
+                dirty.append(rect)
+
+        ## Keep references to surfaces, so their identity can be compared
+        self._previous = current
+        return dirty
+
+    def render(self, target, scene):
+        target_rect = target.get_rect()
+
+        if self._invalid:
+            self._invalid = False
+            self._get_dirty_rects(scene)
+            dirty = [target_rect]
+            scroll = None
+        else:
+            scroll = self._find_scroll(scene, target_rect)
+            dirty = self._get_dirty_rects(scene, scroll)
+
+        dirty = [r.clip(target_rect) for r in dirty]
+        dirty = [r for r in dirty if r.width > 0 and r.height > 0]
+
+        if scroll is not None:
+            region, dy = scroll[:2]
+            target.set_clip(region)
+            target.scroll(0, dy)
+            target.set_clip(None)
+            updated = [region]
+        else:
+            updated = []
+
+        if not dirty:
+            return updated
+
+        if len(dirty) > MAX_DIRTY_RECTS:
+            dirty = [dirty[0].unionall(dirty[1:])]
+
+        ## Clip to each dirty region and redraw everything inside it,
+        ## so semi-transparent surfaces never get blended twice.
+        for dirty_rect in dirty:
+            target.set_clip(dirty_rect)
+            target.fill(BACKGROUND_COLOR)
+            for key, surface, rect, alpha in scene:
+                if rect.colliderect(dirty_rect):
+                    target.blit(surface, rect)
+        target.set_clip(None)
+
+        return updated + dirty
@@ -0,0 +1,77 @@
+"""
+Frame scheduling for the screen main loop.
+"""
+
+import threading
+import time
+
+FRAME_RATE = 60
+
+## Maximum time to sleep between frames, even if nothing is
+## changing on the board: we still need to process pygame events
+## (window resize, keypresses, ..) in a reasonable time.
+MAX_IDLE_TIME = .1
+
+
+class FrameScheduler(object):
+    """
+    Decide when the next frame has to be drawn.
+
+    While something is animating, frames are drawn at ``frame_rate``;
+    otherwise, we sleep until the next scheduled change (a message
+    changing state, the clock ticking, ..) or until someone calls
+    :py:meth:`wake`, eg. because the board was changed via RPC.
+    """
+
+    def __init__(self, frame_rate=FRAME_RATE, max_idle_time=MAX_IDLE_TIME):
+        self.frame_rate = frame_rate
+        self.max_idle_time = max_idle_time
+        self._wakeup = threading.Condition()
+        self._woken = False
+        self._deadline = None
+
+    def schedule(self, when):
+        """
+        Request a frame to be drawn no later than ``when``.
+
+        :param when: Timestamp, as returned by ``time.time()``;
+            ``None`` means "nothing to do".
+        """
+        if when is None:
+            return
+        if self._deadline is None or when < self._deadline:
+            self._deadline = when
+
+    def wake(self):
+        """Wake up the main loop immediately (thread-safe)"""
+        with self._wakeup:
+            self._woken = True
+            self._wakeup.notify()
+
+    def wait(self):
+        """
+        Sleep until the next scheduled frame, or until woken up.
+
+        :return: ``True`` if a frame is due, ``False`` if we just
+            woke up to process events.
+        """
+        deadline, self._deadline = self._deadline, None
+        timeout = self.max_idle_time
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.time())
+
+        ## Test and reset the flag together, so that no wake()
+        ## gets lost in between
+        with self._wakeup:
+            if timeout > 0 and not self._woken:
+                self._wakeup.wait(timeout)
+            woken, self._woken = self._woken, False
+
+        if woken or deadline is None:
+            return woken
+
+        if deadline > time.time():
+            ## Not yet due, keep it for next round
+            self.schedule(deadline)
+            return False
+        return True
@@ -0,0 +1,267 @@
+"""
+Copy-on-write storage for the messages on the wall.
+"""
+
+import bisect
+import copy
+import operator
+import threading
+
+from spotted_wall.server.stats import TimedLock
+from spotted_wall.server.utils import Counter
+
+
+class MessagesSnapshot(object):
+    """
+    Immutable version of the messages index.
+
+    Behaves like a read-only ``{id: message}`` dict, iterating
+    messages in display order: by priority class, then by id.
+    """
+
+    def __init__(self, messages=None, keys=(), version=0):
+        """
+        :param messages: The ``{id: message}`` index
+        :param keys: The sorted ``(priority rank, id)`` keys
+        :param version: Version number of the index
+        """
+        self._messages = messages or {}
+        self._keys = keys
+        self.order = tuple(map(operator.itemgetter(1), keys))
+        self.version = version
+
+    def __len__(self):
+        return len(self.order)
+
+    def __contains__(self, message_id):
+        return message_id in self._messages
+
+    def __getitem__(self, message_id):
+        return self._messages[message_id]
+
+    def __iter__(self):
+        return iter(self.order)
+
+    def get(self, message_id, default=None):
+        return self._messages.get(message_id, default)
+
+    def keys(self):
+        return list(self.order)
+
+    def position(self, message_id):
+        """Position of a message in display order"""
+        key = (self._messages[message_id].priority_rank, message_id)
+        return bisect.bisect_left(self._keys, key)
+
+    def order_after(self, rank, message_id):
+        """
+        Ids of the messages after the given ``(priority rank, id)``
+        key, in display order (the message itself may be gone).
+        """
+        return self.order[bisect.bisect_right(self._keys,
+                                              (rank, message_id)):]
+
+    def iter_waiting(self):
+        """
+        Ids of the messages not shown yet: from the lowest priority
+        class, oldest first in each class.
+
+        Classes are found by bisection, but each one is scanned from
+        its start, checking every message: shown ones mostly come
+        first, but not always (a waiting message moved to another
+        class keeps its place by id, maybe among shown ones).
+        """
+        keys = self._keys
+        end = len(keys)
+        while end:
+            rank = keys[end - 1][0]
+            start = bisect.bisect_left(keys, (rank,), 0, end)
+            for i in xrange(start, end):
+                message_id = keys[i][1]
+                if self._messages[message_id].shown_at is None:
+                    yield message_id
+            end = start
+
+    def iteritems(self):
+        for message_id in self.order:
+            yield message_id, self._messages[message_id]
+
+    def itervalues(self):
+        for message_id in self.order:
+            yield self._messages[message_id]
+
+
+def _remove_keys(keys, messages, message_ids):
+    """
+    Remove some messages from a (copy of the) index, ignoring the
+    missing ones, and return the keys without them.
+    """
+    removed = []
+    for message_id in message_ids:
+        message = messages.pop(message_id, None)
+        if message is not None:
+            removed.append((message.priority_rank, message_id))
+    if not removed:
+        return keys
+    if len(removed) > 64:
+        return tuple(key for key in keys if key[1] in messages)
+    ## Just a few: find them, rather than filtering all the keys
+    keys = list(keys)
+    for key in removed:
+        del keys[bisect.bisect_left(keys, key)]
+    return tuple(keys)
+
+
+class MessageStore(object):
+    """
+    Container for the messages, indexed by id.
+
+    Readers (most notably, the screen drawing each frame) just grab
+    the current :py:meth:`snapshot`, without any locking; writers
+    build an updated copy of the index and publish it atomically,
+    so they never have to wait for a frame to be drawn.
+
+    Messages are never modified in place by writers either: updates
+    are applied to a copy of the message, that replaces the original
+    one in the new version of the index. The screen thread is still
+    free to change the display state (shown time, pause, cached
+    surfaces) of the messages in the snapshot it's drawing: shown
+    and paused times live in a :py:class:`.message.DisplayState`
+    shared with the copies, so they're never lost to a concurrent
+    update.
+    """
+
+    def __init__(self, stats=None):
+        self._snapshot = MessagesSnapshot()
+        self._write_lock = threading.Lock()
+        if stats is not None:
+            self._write_lock = TimedLock(
+                self._write_lock, stats, 'store.lock_wait')
+
+        ## Counter yielding message ids. Just call .next() to get one.
+        self._ids = Counter()
+
+        ## Incremented each time a new version is published
+        self.version = 0
+
+    @property
+    def next_id(self):
+        """The id that will be assigned to the next message"""
+        return self._ids.peek()
+
+    def restore(self, messages, next_id):
+        """
+        Replace all the messages with the given ones, eg. when
+        restoring them from a journal.
+
+        :param messages: A list of ``(message_id, message)`` tuples
+        :param next_id: The id to assign to the next new message
+        """
+        with self._write_lock:
+            self._ids = Counter(next_id)
+            self._publish(dict(messages), tuple(sorted(
+                (message.priority_rank, message_id)
+                for message_id, message in messages)))
+
+    def snapshot(self):
+        """
+        Return the current version of the messages index,
+        as a :py:class:`MessagesSnapshot`.
+        """
+        return self._snapshot
+
+    def _publish(self, messages, keys):
+        self.version += 1
+        self._snapshot = MessagesSnapshot(messages, keys, self.version)
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    def __contains__(self, message_id):
+        return message_id in self._snapshot
+
+    def get(self, message_id):
+        """Get a message by id. Raises KeyError if not found."""
+        return self._snapshot[message_id]
+
+    def add(self, message):
+        """Store a new message, returning its id"""
+        return self.add_many([message])[0]
+
+    def add_many(self, new_messages, remove=()):
+        """
+        Store some new messages at once, returning their ids.
+
+        :param remove: Ids of messages to be removed in the same
+            version (eg. to make room for the new ones)
+        """
+        with self._write_lock:
+            messages = self._snapshot._messages.copy()
+            keys = _remove_keys(self._snapshot._keys, messages, remove)
+            message_ids = []
+            new_keys = []
+            for message in new_messages:
+                message_id = self._ids.next()
+                messages[message_id] = message
+                message_ids.append(message_id)
+                new_keys.append((message.priority_rank, message_id))
+            ## Two sorted runs: merged in linear time
+            self._publish(messages, tuple(sorted(keys + tuple(new_keys))))
+        return message_ids
+
+    def modify(self, message_id, function):
+        """
+        Replace a message with an updated copy.
+
+        :param function: Called with the copy of the message as
+            only argument, should apply the changes to it.
+        """
+        if not self.modify_many([(message_id, function)])[0]:
+            raise KeyError(message_id)
+
+    def modify_many(self, changes):
+        """
+        Replace some messages with updated copies, at once.
+
+        :param changes: A list of ``(message_id, function)`` tuples,
+            see :py:meth:`modify`.
+        :return: A list of booleans, telling whether each message
+            was found and updated.
+        """
+        with self._write_lock:
+            messages = self._snapshot._messages.copy()
+            results = []
+            keys = self._snapshot._keys
+            for message_id, function in changes:
+                if message_id not in messages:
+                    results.append(False)
+                    continue
+                message = copy.copy(messages[message_id])
+                function(message)
+                if message.priority_rank != \
+                        messages[message_id].priority_rank:
+                    keys = None  # To be sorted again
+                messages[message_id] = message
+                results.append(True)
+            if keys is None:
+                keys = tuple(sorted(
+                    (message.priority_rank, message_id)
+                    for message_id, message in messages.iteritems()))
+            if any(results):
+                self._publish(messages, keys)
+        return results
+
+    def remove(self, message_ids):
+        """Remove some messages, ignoring the missing ones"""
+        with self._write_lock:
+            messages = self._snapshot._messages.copy()
+            keys = _remove_keys(self._snapshot._keys, messages, message_ids)
+            if len(messages) != len(self._snapshot):
+                self._publish(messages, keys)
+
+    def clear(self):
+        """Remove all the messages, returning their ids"""
+        with self._write_lock:
+            message_ids = list(self._snapshot.order)
+            self._publish({}, ())
+        return message_ids
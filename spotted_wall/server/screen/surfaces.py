@@ -0,0 +1,103 @@
+"""
+Memory budget for the rendered messages.
+
+Each message keeps its rendered surface (plus the last faded copy
+of it) around, so it doesn't have to be rendered again on each
+frame; on a big screen these take megabytes each. All of them are
+accounted for here, and the ones least recently shown are released
+once they exceed the budget. They're rendered again if needed, the
+message height is kept anyway.
+"""
+
+import collections
+import threading
+
+## Memory the rendered surfaces of all the messages may take, before
+## the least recently shown ones get released.
+SURFACES_BUDGET = 64 * 1024 * 1024
+
+
+class SurfacesBudget(object):
+    """
+    Keeps track of the surfaces rendered for the messages, by message
+    id, in least recently shown order.
+
+    The messages on screen are never released, even if they alone
+    exceed the budget: they'd be rendered again right away.
+    Thread-safe, as messages get rendered by the prerender workers too.
+    """
+
+    def __init__(self, max_size=SURFACES_BUDGET):
+        self.max_size = max_size
+        self.size = 0
+        self.evictions = 0
+        self.evicted_size = 0
+
+        ## {message_id: (message, surfaces size)}, least recent first
+        self._entries = collections.OrderedDict()
+        self._pinned = frozenset()
+        self._lock = threading.Lock()
+
+    def update(self, message_id, message):
+        """
+        Account for the surfaces of a message that was just rendered
+        or shown, making it the most recently used.
+        """
+        size = message.get_surfaces_size()
+        with self._lock:
+            self._pop(message_id)
+            if size:
+                self._entries[message_id] = (message, size)
+                self.size += size
+            self._evict()
+
+    def pin(self, message_ids):
+        """Set the messages on screen, not to be released"""
+        with self._lock:
+            self._pinned = frozenset(message_ids)
+            self._evict()
+
+    def discard(self, message_ids):
+        """Stop tracking some messages, eg. after they are removed"""
+        with self._lock:
+            for message_id in message_ids:
+                self._pop(message_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _pop(self, message_id):
+        entry = self._entries.pop(message_id, None)
+        if entry is not None:
+            self.size -= entry[1]
+        return entry
+
+    def _evict(self):
+        ## Pinned messages are moved to the end, as they're being shown
+        for i in xrange(len(self._entries)):
+            if self.size <= self.max_size:
+                break
+            message_id, (message, size) = self._entries.popitem(last=False)
+            if message_id in self._pinned:
+                self._entries[message_id] = (message, size)
+                continue
+            message.release_surfaces()
+            self.size -= size
+            self.evictions += 1
+            self.evicted_size += size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_usage(self):
+        """Report the memory usage, eg. for the stats"""
+        with self._lock:
+            return {
+                'max_size': self.max_size,
+                'size': self.size,
+                'messages': len(self._entries),
+                'evictions': self.evictions,
+                'evicted_size': self.evicted_size,
+            }
@@ -0,0 +1,290 @@
+"""
+Tiled output: one board, drawn across several displays.
+
+The layout is computed once, on a virtual *canvas*; each tile shows
+a region of it:
+
+- local tiles are drawn on parts of the local window, eg. a window
+  spanning several monitors, with the canvas regions hidden behind
+  the bezels left out;
+- remote render nodes get a description of each frame on a ZeroMQ
+  PUB socket, and draw their own tile of it by rendering the same
+  texts with the same fonts (see :py:mod:`spotted_wall.server.node`).
+"""
+
+import re
+import threading
+
+import pygame
+import zmq
+from smartrpyc.utils.serialization import MsgPackSerializer
+
+from .message import Message
+from .renderer import Scene, DirtyRectRenderer, FullRenderer
+
+TILE_RE = re.compile(r'^(\d+)x(\d+)\+(\d+)\+(\d+)(?:@(\d+)\+(\d+))?$')
+
+## Frames are published at least this often, even if nothing changed,
+## so that render nodes joining late get something to draw.
+REFRESH_INTERVAL = 1.
+
+## Fonts used by the screen, to be matched by the render nodes
+MESSAGES_FONT = 'monospace'
+SERVICE_FONT = 'monospace'
+SERVICE_FONT_SIZE = 16
+SERVICE_COLOR = (255, 255, 255)
+
+
+class Tile(object):
+    """A region of the canvas, shown by one output"""
+
+    def __init__(self, rect, position=None):
+        """
+        :param rect: The region of the canvas, ``(x, y, w, h)``
+        :param position: Where to draw it on the local window
+            (defaults to the region top-left corner)
+        """
+        self.rect = pygame.Rect(rect)
+        if position is None:
+            position = self.rect.topleft
+        self.position = position
+
+    def __repr__(self):
+        return 'Tile({0!r}, {1!r})'.format(tuple(self.rect), self.position)
+
+
+def parse_tile(spec):
+    """
+    Parse a tile geometry, as ``WxH+X+Y``, optionally followed
+    by ``@X+Y`` (its position on the local window).
+    """
+    match = TILE_RE.match(spec)
+    if match is None:
+        raise ValueError("Invalid tile geometry: {0!r}".format(spec))
+    width, height, left, top, pos_left, pos_top = match.groups()
+    position = None
+    if pos_left is not None:
+        position = (int(pos_left), int(pos_top))
+    return Tile((int(left), int(top), int(width), int(height)), position)
+
+
+def get_canvas_size(tiles):
+    """Smallest canvas containing all the tiles"""
+    bounds = tiles[0].rect.unionall([tile.rect for tile in tiles[1:]])
+    return bounds.right, bounds.bottom
+
+
+def describe_scene(scene):
+    """
+    Describe the items of a scene, for remote tiles.
+
+    :return: a dict, with an ``items`` list of
+        ``[key, source, left, top, width, height]``; only items
+        whose source is known are included.
+    """
+    items = []
+    for key, surface, rect, alpha in scene:
+        source = scene.sources.get(key)
+        if source is not None:
+            items.append([key, source, rect.x, rect.y, rect.w, rect.h])
+    return {'items': items}
+
+
+class LocalTileOutput(object):
+    """Draws a tile on a region of the local display surface"""
+
+    def __init__(self, tile, dirty_rects=True):
+        self.tile = tile
+        if dirty_rects:
+            self.renderer = DirtyRectRenderer()
+        else:
+            self.renderer = FullRenderer()
+        self.target = None
+
+    def set_target(self, surface):
+        """Set the display surface (eg. after a mode change)"""
+        region = pygame.Rect(self.tile.position, self.tile.rect.size)
+        region = region.clip(surface.get_rect())
+        self.target = None
+        if region.width and region.height:
+            self.target = surface.subsurface(region)
+        self.renderer.invalidate()
+
+    def invalidate(self):
+        self.renderer.invalidate()
+
+    def render(self, scene):
+        """Draw the tile, returning the updated display regions"""
+        if self.target is None:
+            return []
+        rects = self.renderer.render(
+            self.target, scene.crop(self.tile.rect))
+        offset = self.target.get_abs_offset()
+        return [rect.move(offset) for rect in rects]
+
+
+class SceneBuilder(object):
+    """
+    Rebuilds the scenes described by :py:func:`describe_scene`,
+    on a render node.
+
+    Messages are kept between frames, so they are rendered only
+    once and then just faded.
+    """
+
+    def __init__(self):
+        self._fonts = {}
+        self._messages = {}  # {key: (description, Message)}
+        self._labels = {}
+
+    def _get_font(self, name, size):
+        if (name, size) not in self._fonts:
+            self._fonts[name, size] = pygame.font.SysFont(name, size)
+        return self._fonts[name, size]
+
+    def _get_message_surface(self, key, source, messages):
+        kind, text, color, width, font_size, level = source
+        description = (text, color, width, font_size)
+        cached = self._messages.get(key)
+        if cached is not None and cached[0] == description:
+            message = cached[1]
+        else:
+            message = Message(text, width=width, color=color,
+                              font=self._get_font(MESSAGES_FONT, font_size))
+        messages[key] = (description, message)
+        return message.render_faded(level)
+
+    def _get_label_surface(self, text, labels):
+        surface = self._labels.get(text)
+        if surface is None:
+            font = self._get_font(SERVICE_FONT, SERVICE_FONT_SIZE)
+            surface = font.render(text, True, SERVICE_COLOR)
+        labels[text] = surface
+        return surface
+
+    def build(self, frame, region=None):
+        """
+        Build the scene for a frame.
+
+        :param region: Only build the items falling in this region
+            of the canvas.
+        """
+        scene = Scene()
+        messages = {}
+        labels = {}
+        for key, source, left, top, width, height in frame['items']:
+            if region is not None and \
+                    not region.colliderect((left, top, width, height)):
+                continue
+            if isinstance(key, list):
+                key = tuple(key)
+            if source[0] == 'message':
+                surface = self._get_message_surface(key, source, messages)
+            elif source[0] == 'label':
+                surface = self._get_label_surface(source[1], labels)
+            else:
+                continue  # Unknown item, from a newer server?
+            scene.blit(key, surface, (left, top))
+        self._messages = messages
+        self._labels = labels
+        return scene
+
+
+class RemoteTileRenderer(object):
+    """Draws one tile of the frames described by the server"""
+
+    def __init__(self, tile, dirty_rects=True):
+        self.tile = tile
+        self.builder = SceneBuilder()
+        if dirty_rects:
+            self.renderer = DirtyRectRenderer()
+        else:
+            self.renderer = FullRenderer()
+
+    def invalidate(self):
+        self.renderer.invalidate()
+
+    def render(self, target, frame):
+        """Draw a frame on the target, returning the updated regions"""
+        scene = self.builder.build(frame, region=self.tile.rect)
+        return self.renderer.render(target, scene.crop(self.tile.rect))
+
+
+class RemoteTilesOutput(object):
+    """Sends the frames to the remote render nodes"""
+
+    def __init__(self, publish):
+        """
+        :param publish: Called with each frame description,
+            eg. :py:meth:`TilesPublisherThread.publish`
+        """
+        self.publish = publish
+
+    def invalidate(self):
+        pass
+
+    def render(self, scene):
+        self.publish(describe_scene(scene))
+        return []
+
+
+class LoopbackTileOutput(object):
+    """
+    Stand-in for a remote render node, drawing a tile on an offscreen
+    surface; frames go through the same serialization used on the
+    network.
+    """
+
+    packer = MsgPackSerializer
+
+    def __init__(self, tile, dirty_rects=True):
+        self.tile = tile
+        self.node = RemoteTileRenderer(tile, dirty_rects=dirty_rects)
+        self.surface = pygame.Surface(tile.rect.size)
+
+    def invalidate(self):
+        self.node.invalidate()
+
+    def render(self, scene):
+        frame = self.packer.unpackb(self.packer.packb(describe_scene(scene)))
+        self.node.render(self.surface, frame)
+        return []
+
+
+class TilesPublisherThread(threading.Thread):
+    """
+    Publishes the frame descriptions on a ZeroMQ PUB socket.
+
+    Only the latest frame matters: if the socket can't keep up,
+    the older ones are just dropped.
+    """
+
+    daemon = True
+    parent = None
+    addresses = None
+    packer = MsgPackSerializer
+
+    def __init__(self, parent, addresses):
+        self.parent = parent
+        self.addresses = addresses
+        super(TilesPublisherThread, self).__init__()
+        self._frame = None
+        self._ready = threading.Condition()
+
+    def publish(self, frame):
+        """Replace the frame to be sent next. Thread-safe."""
+        with self._ready:
+            self._frame = frame
+            self._ready.notify()
+
+    def run(self):
+        socket = zmq.Context.instance().socket(zmq.PUB)
+        socket.setsockopt(zmq.SNDHWM, 2)
+        for address in self.addresses:
+            socket.bind(address)
+        while True:
+            with self._ready:
+                while self._frame is None:
+                    self._ready.wait()
+                frame, self._frame = self._frame, None
+            socket.send(self.packer.packb(frame))
@@ -0,0 +1,214 @@
+"""
+Lightweight instrumentation of the hot paths.
+
+Timings are collected in fixed-bucket histograms, cheap enough to
+be always enabled; they can be retrieved via the ``stats`` RPC
+method, or dumped periodically by a :py:class:`StatsDumpThread`.
+"""
+
+import json
+import sys
+import threading
+import time
+import timeit
+
+## Upper bounds of the histogram buckets, in seconds
+BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05,
+           .1, .25, .5, 1., 2.5, 5., float('inf'))
+
+
+class Histogram(object):
+    """Distribution of the values of a measure (eg. a duration)"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, pct):
+        """Approximate percentile: upper bound of the matching bucket"""
+        threshold = self.count * pct / 100.
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if count and seen >= threshold:
+                return min(bound, self.max)
+        return 0.
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'buckets': [[bound if bound != float('inf') else None, count]
+                        for bound, count in zip(self.buckets, self.counts)
+                        if count],
+        }
+
+
+class _Timer(object):
+    """Context manager adding the elapsed time to a histogram"""
+
+    __slots__ = ('stats', 'name', 'start')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = timeit.default_timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stats.record(self.name, timeit.default_timer() - self.start)
+
+
+class TimedLock(object):
+    """Wraps a lock, recording the time spent waiting to acquire it"""
+
+    def __init__(self, lock, stats, name):
+        self.lock = lock
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        start = timeit.default_timer()
+        self.lock.acquire()
+        self.stats.record(self.name, timeit.default_timer() - start)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.lock.release()
+
+
+class Stats(object):
+    """Registry of named histograms, plus some cache counters"""
+
+    def __init__(self):
+        self._histograms = {}
+        self._caches = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def record(self, name, value):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.add(value)
+
+    def timer(self, name):
+        """Return a context manager timing its block"""
+        return _Timer(self, name)
+
+    def register_cache(self, name, function):
+        """
+        Register a cache to be reported.
+
+        :param function: Called without arguments, must return
+            an object with ``hits``, ``misses`` and ``size`` attributes,
+            or a list of them (to be summed up).
+        """
+        self._caches[name] = function
+
+    def register_gauge(self, name, function):
+        """
+        Register some values to be reported, as they are.
+
+        :param function: Called without arguments, must return
+            a dict of values (eg. a memory usage report).
+        """
+        self._gauges[name] = function
+
+    def _get_cache_stats(self, name):
+        caches = self._caches[name]()
+        if not isinstance(caches, (list, tuple)):
+            caches = [caches]
+        hits = sum(c.hits for c in caches)
+        misses = sum(c.misses for c in caches)
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': 1. * hits / (hits + misses) if hits + misses else 0.,
+            'size': sum(c.size for c in caches),
+        }
+
+    def to_dict(self):
+        with self._lock:
+            timings = dict((name, histogram.to_dict())
+                           for name, histogram in self._histograms.iteritems())
+        return {
+            'since': self.started,
+            'timings': timings,
+            'caches': dict((name, self._get_cache_stats(name))
+                           for name in self._caches),
+            'gauges': dict((name, function())
+                           for name, function in self._gauges.iteritems()),
+        }
+
+    def reset(self):
+        with self._lock:
+            for histogram in self._histograms.itervalues():
+                histogram.reset()
+            self.started = time.time()
+
+
+## Process-wide stats registry
+stats = Stats()
+
+
+class StatsMiddleware(object):
+    """SmartRPyC server middleware recording the latency of each call"""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def pre(self, request, method):
+        request._stats_start = timeit.default_timer()
+
+    def post(self, request, method, response, exception):
+        start = getattr(request, '_stats_start', None)
+        if start is not None:
+            self.stats.record('rpc.{}'.format(request.method),
+                              timeit.default_timer() - start)
+
+
+class StatsDumpThread(threading.Thread):
+    """Periodically dumps the stats, as JSON lines"""
+
+    daemon = True
+
+    def __init__(self, stats, interval, filename=None):
+        super(StatsDumpThread, self).__init__()
+        self.stats = stats
+        self.interval = interval
+        self.filename = filename
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            dump = json.dumps(dict(self.stats.to_dict(), time=time.time()))
+            if self.filename is None:
+                sys.stdout.write(dump + '\n')
+            else:
+                with open(self.filename, 'a') as f:
+                    f.write(dump + '\n')
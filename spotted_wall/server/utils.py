@@ -5,6 +5,15 @@
 
 import colorsys
 import random
+import threading
+import weakref
+from collections import OrderedDict
+
+## Maximum number of word widths to remember, per font
+WORD_WIDTHS_CACHE_SIZE = 4096
+
+## Memory budget for the rendered text lines cache, in bytes
+RENDERED_LINES_CACHE_SIZE = 32 * 1024 * 1024
 
 
 def circular_generator(items):
@@ -89,50 +98,169 @@ class Counter(object):
         self._count += 1
         return c
 
+    def peek(self):
+        """Return the next value, without consuming it"""
+        return self._count
+
+
+class LRUCache(object):
+    """
+    Thread-safe mapping holding up to ``max_size`` items,
+    evicting the least recently used ones first.
+
+    If a ``sizeof`` function is passed, ``max_size`` is instead the
+    maximum total size of the values, as returned by it.
+    """
+
+    def __init__(self, max_size, sizeof=None):
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda value: 1)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value  # Move to the end
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            if key in self._data:
+                self.size -= self.sizeof(self._data.pop(key))
+            self._data[key] = value
+            self.size += self.sizeof(value)
+            while self.size > self.max_size and self._data:
+                old_key, old_value = self._data.popitem(last=False)
+                self.size -= self.sizeof(old_value)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+
+## Font -> LRUCache of text widths
+_text_widths = weakref.WeakKeyDictionary()
+
+
+def measure_pygame_text(font, text):
+    """Return the width of some text in the given font, cached"""
+
+    try:
+        widths = _text_widths[font]
+    except KeyError:
+        widths = _text_widths[font] = LRUCache(WORD_WIDTHS_CACHE_SIZE)
+
+    width = widths.get(text)
+    if width is None:
+        width = widths[text] = font.size(text)[0]
+    return width
+
+
+def pygame_surface_size(surface):
+    """Approximate memory used by a surface, in bytes"""
+    return surface.get_pitch() * surface.get_height()
+
+
+## (font, color, text) -> rendered surface, shared by all messages
+rendered_lines_cache = LRUCache(
+    RENDERED_LINES_CACHE_SIZE, sizeof=pygame_surface_size)
+
+
+def render_pygame_text(font, text, color):
+    """
+    Render a line of text, reusing an already rendered surface
+    for the same font, color and text if available.
+
+    **Beware!** The returned surface is shared: never modify it.
+    """
+
+    key = (font, tuple(color), text)
+    rendered = rendered_lines_cache.get(key)
+    if rendered is None:
+        rendered = rendered_lines_cache[key] = font.render(text, True, color)
+    return rendered
+
+
+def get_text_widths_caches():
+    """Return the text widths caches for all the fonts"""
+    return _text_widths.values()
+
+
+def _split_pygame_word(font, word, width):
+    """Split a word too long to fit in width, character by character"""
+
+    chunk_start, chunk_width = 0, 0
+    for i, char in enumerate(word):
+        char_width = measure_pygame_text(font, char)
+        if chunk_width + char_width > width and i > chunk_start:
+            yield word[chunk_start:i], chunk_width
+            chunk_start, chunk_width = i, 0
+        chunk_width += char_width
+    yield word[chunk_start:], chunk_width
+
 
 def wrap_pygame_text(font, words, width, separator=' '):
-    """Wrap some text to fit a given width"""
+    """
+    Wrap some text to fit a given width.
+
+    Each word is measured just once (widths are cached per-font),
+    then lines are filled greedily; words longer than a whole line
+    get split across lines.
+    """
 
     if isinstance(words, basestring):
         words = words.split()
 
-    _fulltext = separator.join(words)
-    if font.size(_fulltext)[0] <= width:
-        yield _fulltext
+    if not words:
+        yield ''  # Keep blank lines
         return
 
-    words_iter = SeekableIterator(words)
-
-    current_line = []
+    separator_width = measure_pygame_text(font, separator)
+    current_line, current_width = [], 0
 
-    try:
-
-        while True:
-            next_word = words_iter.next()
+    for word in words:
+        word_width = measure_pygame_text(font, word)
 
-            wannabe_nextline = separator.join(current_line + [next_word])
-            if font.size(wannabe_nextline)[0] <= width:
+        if current_line:
+            if current_width + separator_width + word_width <= width:
                 ## Continue adding to current line
-                current_line.append(next_word)
+                current_line.append(word)
+                current_width += separator_width + word_width
+                continue
 
-            else:
+            ## It doesn't fit, flush the buffer..
+            yield separator.join(current_line)
+            current_line, current_width = [], 0
 
-                ## It doesn't fit, so we have to free up things.
-                if len(current_line) > 0:
-                    ## Flush the buffer..
-                    yield separator.join(current_line)
-                    current_line = []
-                    words_iter.seek(-1)  # It will be reprocessed again..
+        if word_width > width:
+            ## The word itself is too long: wrap it, keeping the
+            ## last chunk in the buffer.
+            chunks = list(_split_pygame_word(font, word, width))
+            for chunk, chunk_width in chunks[:-1]:
+                yield chunk
+            word, word_width = chunks[-1]
 
-                else:
-                    ## the word itself is too long.. wrap it
-                    ## todo: I said, *wrap* it!!
-                    yield next_word
+        current_line, current_width = [word], word_width
 
-    except StopIteration:
-        ## If we have stuff in the buffer, flush it
-        if len(current_line) > 0:
-            yield separator.join(current_line)
+    ## If we have stuff in the buffer, flush it
+    if current_line:
+        yield separator.join(current_line)
 
 
 def pygame_color_to_hex(c):
@@ -1,30 +1,197 @@
 """
 :author: samu
 :created: 3/5/13 4:28 PM
+
+Web UI for the wall.
+
+The index page is just a shell: browsers get the list of messages
+from ``/messages.json`` (served with an ETag, so re-fetching an
+unchanged board costs a 304) and then follow the board changes
+via server-sent events, from ``/events``.
 """
 
-from flask import Flask, render_template, request, redirect, url_for
+import collections
+import json
+import threading
+import time
+
+from flask import Flask, Response, render_template, request, redirect, \
+    url_for, jsonify, abort
+
+from spotted_wall.server.admission import AdmissionError, \
+    RateLimitExceeded, clamp_priority
+from spotted_wall.server.events import EV_ADDED, EV_UPDATED, \
+    EV_STATE_CHANGED
+from spotted_wall.server.screen.message import PRIORITIES, \
+    DEFAULT_PRIORITY
+
+## Number of recent events kept, for browsers reconnecting
+EVENTS_BACKLOG = 1000
+
+## Send a comment on idle streams this often, so that proxies
+## (and browsers) don't consider them dead.
+KEEPALIVE_INTERVAL = 15
+
+## Fields of the messages sent to the browsers
+MESSAGE_FIELDS = ['text', 'color', 'priority']
+
+## Messages posted from the web UI are typed by people: they come
+## before the ones from bots, posting via RPC. The form may only
+## lower their priority.
+WEB_UI_PRIORITY = 'high'
+
+## Part of the ETags, so they don't match after a server restart
+_ETAG_PREFIX = '{0:x}'.format(int(time.time()))
+
+
+class EventsBroadcaster(object):
+    """
+    Keeps the recent board events, numbered, for the event streams.
+
+    Subscribed to the board events, it just appends them to a
+    bounded buffer and wakes up the streams waiting for them.
+    """
+
+    def __init__(self, size=EVENTS_BACKLOG):
+        self._events = collections.deque(maxlen=size)
+        self._condition = threading.Condition()
+        self.last_id = 0
+
+    def publish(self, event):
+        """Events listener"""
+        if event['type'] == EV_STATE_CHANGED:
+            return  # Not shown on the web UI
+        if event['type'] in (EV_ADDED, EV_UPDATED):
+            event = dict(event, message=dict(
+                (key, value) for key, value in event['message'].iteritems()
+                if key in MESSAGE_FIELDS))
+        with self._condition:
+            self.last_id += 1
+            self._events.append((self.last_id, event))
+            self._condition.notify_all()
+
+    def get_events(self, last_id, timeout=None):
+        """
+        Return the events after ``last_id``, waiting for some if
+        there are none yet.
+
+        :return: a list of ``(event_id, event)`` tuples (empty on
+            timeout), or ``None`` if some of the requested events
+            are already gone.
+        """
+        with self._condition:
+            if last_id > self.last_id:
+                return None  # From before a restart
+            if last_id == self.last_id:
+                self._condition.wait(timeout)
+            if self._events and last_id < self._events[0][0] - 1:
+                return None
+            return [(event_id, event) for event_id, event in self._events
+                    if event_id > last_id]
 
 
 class MyFlask(Flask):
     spotted_wall = None  # Will be fitted in other thread..
-    pass
+    broadcaster = None
+    rate_limiter = None
 
 app = MyFlask(__name__)
 
 
+def _format_event(event_id, event_type, data):
+    return 'id: {0}\nevent: {1}\ndata: {2}\n\n'.format(
+        event_id, event_type, json.dumps(data))
+
+
+def _stream_events(broadcaster, last_id):
+    yield 'retry: 2000\n\n'
+    while True:
+        events = broadcaster.get_events(last_id, timeout=KEEPALIVE_INTERVAL)
+        if events is None:
+            ## Too far behind: the browser has to reload the list
+            last_id = broadcaster.last_id
+            yield _format_event(last_id, 'reset', {})
+        elif events:
+            last_id = events[-1][0]
+            yield ''.join(_format_event(event_id, event['type'], event)
+                          for event_id, event in events)
+        else:
+            yield ': keepalive\n\n'
+
+
 @app.route("/")
 def index():
+    return render_template('index.jinja', priorities=PRIORITIES,
+                           default_priority=DEFAULT_PRIORITY)
+
+
+@app.route("/messages.json")
+def list_messages():
     spotted_wall = app.spotted_wall
-    return render_template(
-        'index.jinja',
-        messages=spotted_wall.list_messages())
+
+    ## Take the events position first: events received later
+    ## may be already applied, but none will be missed.
+    last_event_id = app.broadcaster.last_id
+    snapshot = spotted_wall.store.snapshot()
+
+    etag = '{0}-{1:x}'.format(_ETAG_PREFIX, snapshot.version)
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        messages = []
+        for message_id, message in snapshot.iteritems():
+            msg = message.to_dict(fields=MESSAGE_FIELDS)
+            msg['id'] = message_id
+            messages.append(msg)
+        response = jsonify(messages=messages)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Last-Event-Id'] = str(last_event_id)
+    return response
+
+
+@app.route("/events")
+def events():
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        last_id = int(last_id)
+    except (TypeError, ValueError):
+        last_id = app.broadcaster.last_id
+    response = Response(_stream_events(app.broadcaster, last_id),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Disable proxy buffering
+    return response
 
 
 @app.route('/add', methods=['GET', 'POST'])
 def add_message():
     if request.method == 'POST':
         spotted_wall = app.spotted_wall
-        spotted_wall.add_message(request.form['message'])
+        priority = request.form.get('priority') or WEB_UI_PRIORITY
+        if priority not in PRIORITIES:
+            abort(400)
+        priority = clamp_priority(priority, WEB_UI_PRIORITY)
+        try:
+            if app.rate_limiter is not None:
+                app.rate_limiter.consume(request.remote_addr)
+            spotted_wall.add_message(request.form['message'],
+                                     color=request.form.get('color') or None,
+                                     priority=priority)
+        except AdmissionError, e:
+            ## Too fast, or the wall is full
+            status = 429 if isinstance(e, RateLimitExceeded) else 503
+            return Response(str(e), status=status, mimetype='text/plain')
         return redirect(url_for('index'))
-    return render_template('add.jinja')
+    return render_template(
+        'add.jinja', default_priority=WEB_UI_PRIORITY,
+        priorities=PRIORITIES[PRIORITIES.index(WEB_UI_PRIORITY):])
+
+
+@app.route('/messages/<int:message_id>/delete', methods=['POST'])
+def delete_message(message_id):
+    try:
+        app.spotted_wall.delete_message(message_id)
+    except KeyError:
+        abort(404)
+    return Response(status=204)